@@ -22,8 +22,8 @@ from . interface import BaseInterface
 
 class AliasInterface(BaseInterface):
 
-    commands = ['list', 'create', 'edit', 'info', 'delete']
     name = 'aliases'
+    key_name = 'domain'
 
     @plac.annotations(
         domain=('Alias domain', 'positional', None, str, None, 'DOMAIN'),
@@ -68,5 +68,11 @@ class AliasInterface(BaseInterface):
         response, content = self.api.get(self.root_url, quiet=quiet)
         content = content or {}
 
-        for domain, data in content.iteritems():
-            self.log.info(" • {domain} => {destination}".format(**data))
+        with self.output.collection(self.key_name) as out:
+            for domain, data in sorted(content.iteritems()):
+                if full:
+                    out.record(domain, data)
+                    continue
+
+                out.record(domain, data,
+                           line=" • {domain} => {destination}".format(**data))
@@ -16,15 +16,20 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import base64
+import hashlib
+import httplib
 import os
 import plac
+import sys
+import time
 from . interface import BaseInterface
 
 
 class ArchiveInterface(BaseInterface):
 
-    commands = ['list', 'create', 'rename', 'download', 'delete']
     name = 'archives'
+    chunk_size = 256 * 1024
 
     @plac.annotations(
         domain=('Instance to archive', 'positional', None, str,
@@ -45,16 +50,155 @@ class ArchiveInterface(BaseInterface):
     def rename(self, name, new_name):
         self.api.put(self.get_url(name), {'name': new_name})
 
+    def expected_digest(self, headers, checksum=None):
+        """ Return the sha256 digest the archive is expected to have, either
+            given by the user as hex or sent by the server as RFC 3230
+            "Digest: SHA-256=<base64>" header.
+        """
+        if checksum:
+            return checksum.lower()
+
+        for digest in headers.get('digest', '').split(","):
+            algo, _, value = digest.strip().partition("=")
+            if algo.upper() == 'SHA-256' and value:
+                return base64.b64decode(value).encode('hex')
+
+    def print_progress(self, done, total, transferred, start):
+        elapsed = time.time() - start
+        rate = transferred / elapsed / 1024 / 1024 if elapsed else 0
+        if total:
+            sys.stderr.write("\r{:>10.1f}/{:.1f} MB {:>6.1%} {:>8.2f} MB/s"\
+                             .format(done / 1024.0 / 1024, total / 1024.0 /
+                                     1024, float(done) / total, rate))
+        else:
+            sys.stderr.write("\r{:>10.1f} MB {:>8.2f} MB/s"\
+                             .format(done / 1024.0 / 1024, rate))
+        sys.stderr.flush()
+
     @plac.annotations(
         name=('Archive to download', 'positional', None, str, None, 'NAME'),
         destination=('Path where to save the archive', 'positional', None,
-                     str, None, 'PATH')
+                     str, None, 'PATH'),
+        checksum=('Expected SHA256 of the archive', 'option', 'c', str, None,
+                  'SHA256'),
+        progress=('Show download progress and throughput', 'flag', 'p'),
+        restart=('Discard any partial download and start over', 'flag', 'r')
     )
-    def download(self, name, destination):
-        response, content = self.api.get(self.get_url(name))
+    def download(self, name, destination, checksum=None, progress=False,
+                 restart=False):
+        """ Download an archive. Data is streamed to PATH.part, and an
+            interrupted download is resumed when the command is run again.
+        """
         if os.path.isdir(destination):
             destination = os.path.join(destination, name)
         destination = "{}.tar.gz".format(destination)
+        partial = "{}.part".format(destination)
+
+        digest = hashlib.sha256()
+        offset = 0
+        if os.path.exists(partial) and not restart:
+            with open(partial, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), ''):
+                    digest.update(chunk)
+                    offset = offset + len(chunk)
+
+        headers = {}
+        if offset:
+            self.log.info("Resuming download from byte %d", offset)
+            headers['Range'] = 'bytes={}-'.format(offset)
+
+        response, content = self.api.get(self.get_url(name), stream=True,
+                                         headers=headers)
+        if not response:
+            return
+
+        if offset and response.status_code != 206:
+            self.log.info("Server cannot resume the download, starting over")
+            digest = hashlib.sha256()
+            offset = 0
+
+        total = response.headers.get('content-range', '').rpartition("/")[2]
+        if not total.isdigit():
+            total = response.headers.get('content-length', '')
+            total = offset + int(total) if total.isdigit() else None
+        total = int(total) if total else None
+
+        received = 0
+        start = time.time()
+        try:
+            with open(partial, 'ab' if offset else 'wb') as f:
+                for chunk in response.iter_content(self.chunk_size):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    received = received + len(chunk)
+                    if progress:
+                        self.print_progress(offset + received, total,
+                                            received, start)
+
+        except (IOError, httplib.HTTPException) as e:
+            self.log.error("Download interrupted: %s. Run the command again "
+                           "to resume it.", e)
+            return
+
+        finally:
+            if progress:
+                sys.stderr.write("\n")
+
+        if total and offset + received < total:
+            self.log.error("Download incomplete (%d of %d bytes). Run the "
+                           "command again to resume it.", offset + received,
+                           total)
+            return
+
+        expected = self.expected_digest(response.headers, checksum)
+        if expected and expected != digest.hexdigest():
+            self.log.error("Checksum mismatch: expected %s, got %s",
+                           expected, digest.hexdigest())
+            os.unlink(partial)
+            return
+
+        os.rename(partial, destination)
+        self.log.info("Saved %s (sha256: %s)", destination, digest.hexdigest())
+
+    def file_digest(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), ''):
+                digest.update(chunk)
+        return digest
+
+    @plac.annotations(
+        path=('Archive file to upload', 'positional', None, str, None, 'FILE'),
+        name=('Archive name (defaults to the file name)', 'option', 'n', str,
+              None, 'NAME')
+    )
+    def upload(self, path, name=None):
+        """ Upload a local archive, unless the server already has an archive
+            with the same SHA256. Returns the name of the archive.
+        """
+        digest = self.file_digest(path)
+        response, content = self.api.get(self.root_url, quiet=True,
+                            query_params={'sha256': digest.hexdigest()})
+        content = content or {}
+        existing = sorted(a for a in content
+                          if content[a].get('sha256') == digest.hexdigest())
+        if existing:
+            self.log.info("Archive already on server as %s, skipping upload",
+                          existing[0])
+            return existing[0]
+
+        if not name:
+            name = os.path.basename(path)
+            if name.endswith(".tar.gz"):
+                name = name[:-len(".tar.gz")]
+
+        headers = {'Content-Type': 'application/x-gzip',
+                   'Digest': 'SHA-256={}'.format(
+                                        base64.b64encode(digest.digest()))}
+        # passing the file object makes httplib stream it from disk
+        with open(path, 'rb') as f:
+            response, content = self.api.put(self.get_url(name), f,
+                                             headers=headers)
 
-        with open(destination, 'w') as f:
-            f.write(response.content)
+        if response:
+            return name
@@ -24,14 +24,36 @@ class AybuManagerCliReadline(plac.ReadlineInput):
         self.factory = factory
         super(AybuManagerCliReadline, self).__init__([], histfile=histfile)
 
+    def readline(self, prompt=''):
+        # the maintainer thread keeps the state up to date: reading it
+        # never blocks the prompt
+        maintainer = self.factory.maintainer
+        if maintainer and maintainer.state:
+            prompt = "{} [{}]> ".format(prompt.rstrip("> "),
+                                        maintainer.describe())
+        return super(AybuManagerCliReadline, self).readline(prompt)
+
     def complete(self, kw, state):
+        # readline asks for every candidate in turn, increasing state:
+        # compute the candidates only once per completion
+        if state == 0:
+            self.matches = self.get_matches(kw) or []
+
+        try:
+            return self.matches[state]
+
+        except IndexError:
+            return
+
+    def get_matches(self, kw):
         current_line = self.rl.get_line_buffer()
         parts = current_line.split(" ")
         nparts = len(parts)
 
         if nparts == 1 or parts[0] == 'help':
             # complete commands
-            completions = [c for c in self.factory.commands if c.startswith(kw)]
+            completions = [c for c in self.factory.all_commands
+                           if c.startswith(kw)]
 
         elif nparts == 2:
             # demand completion to interface
@@ -42,8 +64,4 @@ class AybuManagerCliReadline(plac.ReadlineInput):
         else:
             return
 
-        try:
-            return completions[state]
-
-        except IndexError:
-            return
+        return completions
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import shlex
+import threading
+import time
+from collections import namedtuple
+from StringIO import StringIO
+from . output import Output
+
+log = logging.getLogger(__name__)
+
+Step = namedtuple('Step', ('lineno', 'args'))
+Result = namedtuple('Result', ('step', 'ok', 'elapsed'))
+
+
+class BatchFailed(Exception):
+    pass
+
+
+def parse_script(lines):
+    """ Parse a batch script, one command per line. Commands between
+        "parallel {" and "}" lines are run concurrently.
+        Returns a list of steps, each one a Step or a list of Steps.
+    """
+    steps = []
+    block = None
+    for lineno, line in enumerate(lines, 1):
+        args = shlex.split(line, comments=True)
+        if not args:
+            continue
+
+        if args == ['parallel', '{']:
+            if block is not None:
+                raise ValueError("line {}: parallel blocks cannot be nested"\
+                                 .format(lineno))
+            block = []
+
+        elif args == ['}']:
+            if block is None:
+                raise ValueError("line {}: unexpected }}".format(lineno))
+            if block:
+                steps.append(block)
+            block = None
+
+        elif block is not None:
+            block.append(Step(lineno, args))
+
+        else:
+            steps.append(Step(lineno, args))
+
+    if block is not None:
+        raise ValueError("Unterminated parallel block")
+
+    return steps
+
+
+class Batch(object):
+    """ Run the steps of a batch script with the parser of the interpreter
+        of main, so that every command shares its client.
+    """
+    log = log
+
+    def __init__(self, main, parser, keep_going=False):
+        self.main = main
+        self.parser = parser
+        self.keep_going = keep_going
+        self.results = []
+
+    def run(self, steps):
+        """ Run steps, stopping at the first failure unless keep_going.
+            Returns the list of failed Results.
+        """
+        start = time.time()
+        for step in steps:
+            if isinstance(step, Step):
+                results = [self.run_command(step)]
+
+            else:
+                results = self.run_parallel(step)
+
+            self.results.extend(results)
+            if not self.keep_going and not all(r.ok for r in results):
+                break
+
+        failed = [r for r in self.results if not r.ok]
+        self.log.info("Batch: %d commands, %d failed in %.2fs",
+                      len(self.results), len(failed), time.time() - start)
+        return failed
+
+    def execute(self, step):
+        """ Call the command of step, returning True on success """
+        try:
+            cmd, result = self.parser.consume(list(step.args))
+            if hasattr(result, 'next'):
+                for value in result:
+                    pass
+
+        except SystemExit as e:
+            # raised by argparse on invalid arguments
+            if e.code not in (0, None):
+                self.log.error("line %d: %s", step.lineno, e.code)
+                return False
+
+        except Exception as e:
+            self.log.error("line %d: %s: %s", step.lineno,
+                           type(e).__name__, e)
+            return False
+
+        return True
+
+    def run_command(self, step):
+        start = time.time()
+        ok = self.execute(step)
+        elapsed = time.time() - start
+        self.log.info("[%s] line %d: %s (%.2fs)", "OK" if ok else "FAILED",
+                      step.lineno, " ".join(step.args), elapsed)
+        return Result(step, ok, elapsed)
+
+    def run_parallel(self, steps):
+        """ Run steps each in its own thread. Their output is buffered and
+            written in script order once all of them are done.
+        """
+        results = [None] * len(steps)
+        buffers = [StringIO() for step in steps]
+        output = self.main.output
+
+        def run(i):
+            self.main.local.output = Output(output.format, stream=buffers[i],
+                                            flush_interval=None)
+            try:
+                results[i] = self.run_command(steps[i])
+
+            finally:
+                self.main.local.output.flush()
+                del self.main.local.output
+
+        start = time.time()
+        threads = [threading.Thread(target=run, args=(i, ),
+                                    name='batch-{}'.format(step.lineno))
+                   for i, step in enumerate(steps)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            # join with a timeout, so that ctrl-c is not ignored
+            while thread.is_alive():
+                thread.join(0.5)
+
+        for buf in buffers:
+            output.write(buf.getvalue())
+        output.flush()
+
+        self.log.info("Parallel block at line %d: %d commands in %.2fs",
+                      steps[0].lineno - 1, len(steps), time.time() - start)
+        return [r or Result(s, False, 0) for r, s in zip(results, steps)]
@@ -17,41 +17,89 @@ limitations under the License.
 """
 
 import ast
+import collections
 import ConfigParser
-import json
 import logging
 import os
 import platform
-import requests
+import Queue
 import httplib
 import sys
+import threading
+import time
 import urllib
-import zmq
+from . import codec
+from . import jsonstream
+from . metrics import Metrics
+
+# requests, zmq and the thread pool are slow to import: they are imported
+# on first use, so that commands that do not need them start quickly.
 
 log = logging.getLogger(__name__)
+counter_lock = threading.Lock()
+
+
+class TaskTimeout(Exception):
+    pass
 
 
 class AybuManagerClient(object):
     log = log
+    # task statuses reported by /tasks/<uuid> for tasks still to complete
+    pending_statuses = ('UNDEFINED', 'DEFERRED', 'QUEUED', 'STARTED',
+                        'RUNNING', 'PENDING')
+    # response bodies larger than this are logged truncated when debugging
+    debug_body_size = 65536
+    # the number of the next task submitted by this process
+    counter = 0
 
     def __init__(self, host, subscription_addr,
                  username=None, password=None, timeout=None,
-                 debug=False, verify_ssl=False):
+                 debug=False, verify_ssl=False, pool_connections=10,
+                 pool_maxsize=10, keepalive_timeout=None, task_timeout=None,
+                 heartbeat_interval=10, cache_size=16 * 1024 * 1024,
+                 cache_dir=None, json_codec=None):
 
         self.host = host
         self.username = username
         self.password = password
         self.sub_addr = subscription_addr
-        self.zmq_context = zmq.Context()
-        self.zmq_response_socket = self.zmq_context.socket(zmq.SUB)
-        self.zmq_response_socket.connect(self.sub_addr)
-        self.counter = 0
+        self._zmq_context = None
+        self._subscription = None
+        # guards the lazily created session and subscription
+        # when commands run in several threads
+        self.lock = threading.RLock()
         self.config = None
         self.auth_info = None if not username or not password \
                          else (username, password)
         self.timeout = timeout
         self.debug = debug
         self.verify_ssl = verify_ssl
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keepalive_timeout = keepalive_timeout
+        self.task_timeout = task_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self._session = None
+        self._session_last_used = None
+        # set by ping when the remote cannot be reached: the pooled
+        # connections are most likely dead, the next request recycles them
+        self._session_stale = False
+        self.on_change = []
+        # called with (uuid, status, method, path) when a task is submitted,
+        # and with (uuid, status) when its final status is known
+        self.on_task = []
+        # requests that failed, by connection or with an error status the
+        # caller did not expect
+        self.errors = 0
+        self.metrics = Metrics()
+        self.codec = codec.get(json_codec)
+        self.cache = None
+        if cache_size:
+            from . httpcache import HTTPCache
+            self.cache = HTTPCache(cache_size, cache_dir and
+                                   os.path.expanduser(cache_dir))
+            self.on_change.append(self.cache.invalidate)
         if debug:
             self.log.debug("Created client for {} (user: {}, sub: {})"\
                     .format(self.host, self.username, self.sub_addr))
@@ -65,12 +113,9 @@ class AybuManagerClient(object):
         return httplib.responses[status_code]
 
     @classmethod
-    def create_from_config(cls, configfile, debug=False,
-                           remote='default',
-                           overrides={}):
+    def read_config(cls, configfile):
         config = ConfigParser.ConfigParser()
-        cls.log.debug("Reading config from %s, remote <%s>",
-                      configfile, remote)
+        cls.log.debug("Reading config from %s", configfile)
         try:
             with open(configfile) as f:
                 config.readfp(f)
@@ -79,12 +124,31 @@ class AybuManagerClient(object):
             cls.log.critical("Cannot read config file: {}".format(e))
             raise
 
+        return config
+
+    @classmethod
+    def create_from_config(cls, configfile, debug=False,
+                           remote='default',
+                           overrides={}, config=None):
+        """ Create the client of remote, a section of configfile. config
+            is configfile already parsed, if available.
+        """
+        if config is None:
+            config = cls.read_config(configfile)
+        cls.log.debug("Creating client for remote <%s>", remote)
+
         kwargs = {'debug': debug}
         for var in ('username', 'password', 'host', 'subscription_addr',
-                    'timeout', 'verify_ssl'):
+                    'timeout', 'verify_ssl', 'pool_connections',
+                    'pool_maxsize', 'keepalive_timeout', 'task_timeout',
+                    'heartbeat_interval', 'cache_size', 'cache_dir',
+                    'json_codec'):
             try:
                 kwargs[var] = config.get(remote, var, vars=overrides)
-                if var == 'verify_ssl':
+                if var in ('verify_ssl', 'timeout', 'pool_connections',
+                           'pool_maxsize', 'keepalive_timeout',
+                           'task_timeout', 'heartbeat_interval',
+                           'cache_size'):
                     kwargs[var] = ast.literal_eval(kwargs[var])
 
             except ValueError:
@@ -101,12 +165,118 @@ class AybuManagerClient(object):
         obj.config = config
         return obj
 
+    @property
+    def session(self):
+        """ The keep-alive session shared by every request to this remote.
+            It is recycled when it has been idle for more than
+            keepalive_timeout seconds, as the server has most likely
+            dropped the pooled connections in the meantime.
+        """
+        with self.lock:
+            now = time.time()
+            if self._session and self.keepalive_timeout and \
+               now - self._session_last_used > self.keepalive_timeout:
+                self.log.debug("Session idle for more than %ss, recycling",
+                               self.keepalive_timeout)
+                self.close_session()
+
+            elif self._session and self._session_stale:
+                self.log.debug("Remote was unreachable, recycling session")
+                self.close_session()
+            self._session_stale = False
+
+            if not self._session:
+                import requests
+                config = dict(keep_alive=True,
+                              pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize)
+                self._session = requests.session(auth=self.auth_info,
+                                                 timeout=self.timeout,
+                                                 verify=self.verify_ssl,
+                                                 config=config)
+
+            self._session_last_used = now
+            return self._session
+
+    def close_session(self):
+        if self._session:
+            self._session.close()
+            self._session = None
+
+    def ping(self, timeout=5):
+        """ A HEAD request to the root of the API, keeping a pooled
+            connection open. It is neither logged nor timed. Returns False
+            if the server cannot be reached, marking the session stale so
+            that the next request opens new connections. The session is
+            never closed here, and once stale it is not used either: the
+            server is probed with a connection of its own.
+        """
+        import requests
+        try:
+            if self._session_stale:
+                response = requests.head(self.url('/'), auth=self.auth_info,
+                                         timeout=timeout,
+                                         verify=self.verify_ssl,
+                                         config=dict(verbose=None))
+            else:
+                response = self.session.head(self.url('/'), timeout=timeout,
+                                             config=dict(verbose=None))
+
+        except requests.exceptions.RequestException:
+            self._session_stale = True
+            return False
+
+        # any response will do, but those of a proxy in front of a
+        # manager that is down
+        return response.status_code not in (httplib.BAD_GATEWAY,
+                                            httplib.SERVICE_UNAVAILABLE,
+                                            httplib.GATEWAY_TIMEOUT)
+
+    @property
+    def zmq_context(self):
+        """ The process-wide context, shared by the clients of every
+            remote. It is never terminated by a client: see
+            ClientPool.close.
+        """
+        with self.lock:
+            if not self._zmq_context:
+                import zmq
+                self._zmq_context = zmq.Context.instance()
+            return self._zmq_context
+
+    @property
+    def subscription(self):
+        """ The subscription to task messages, connected on first use """
+        with self.lock:
+            if not self._subscription:
+                from . subscription import Subscription
+                self._subscription = Subscription(self.zmq_context,
+                                                  self.sub_addr,
+                                                  self.uuid_prefix())
+            return self._subscription
+
+    def close(self):
+        """ Release pooled connections and the subscription socket """
+        self.close_session()
+        if self._subscription:
+            self._subscription.close()
+            self._subscription = None
+        self._zmq_context = None
+
+    def uuid_prefix(self):
+        return '{}..{}.{}-'.format(self.username.replace("@", "."),
+                                   platform.uname()[1],
+                                   os.getpid())
+
     def uuid(self):
-        uuid = '{}..{}.{}-{}'.format(self.username.replace("@", "."),
-                                 platform.uname()[1],
-                                 os.getpid(),
-                                 self.counter)
-        self.zmq_response_socket.setsockopt(zmq.SUBSCRIBE, uuid)
+        """ A new task uuid, whose messages are followed from now on """
+        # the counter is shared by the clients of every remote, as they
+        # all have the same prefix
+        with counter_lock:
+            uuid = '{}{}'.format(self.uuid_prefix(),
+                                 AybuManagerClient.counter)
+            AybuManagerClient.counter = AybuManagerClient.counter + 1
+        self.subscription.follow(uuid)
         return uuid
 
     def url(self, path_info, query_params=None):
@@ -122,64 +292,134 @@ class AybuManagerClient(object):
             self.log.debug(" {:<20}: {}".format(h.title(), headers[h]))
 
     def request(self, method, url, *args, **kwargs):
+        path = url
         url = self.url(url, kwargs.pop('query_params', None))
 
-        auth = kwargs.pop('auth', self.auth_info)
-        timeout = kwargs.pop('timeout', self.timeout)
-        kwargs.update(dict(timeout=timeout, auth=auth))
-        kwargs.update(dict(verify=self.verify_ssl))
+        import requests
+        # the verbose stream is copied in the session config on creation,
+        # pass it on each request so set_log_level is honored at runtime.
+        verbose = sys.stderr if self.log.isEnabledFor(logging.DEBUG) \
+                  else None
+        kwargs.update(dict(config=dict(verbose=verbose)))
 
         quiet = kwargs.pop('quiet', False)
+        # error statuses handled by the caller, neither logged nor counted
+        expect = kwargs.pop('expect', ())
         debug = self.debug or kwargs.pop('debug', False)
+        # when streaming the body is left on the socket for the caller
+        stream = kwargs.pop('stream', False)
+        if stream:
+            kwargs['prefetch'] = False
 
         if debug:
             quiet = False
 
+        # revalidate cached responses, unless the caller is making its own
+        # conditional request
+        cached = None
+        headers = kwargs.get('headers') or {}
+        if self.cache and method.lower() == 'get' and not stream and \
+           not any(h.lower() in ('if-none-match', 'if-modified-since')
+                   for h in headers):
+            cached = self.cache.get(url)
+            if cached:
+                kwargs['headers'] = dict(headers, **cached.validators())
+
+        # the body is always read after the headers, to time them apart
+        kwargs['prefetch'] = False
+        start = time.time()
         try:
             self.log.debug("Request\t: %s %s\nArgs\t: %s %s",
                            method.upper(), url, args, kwargs)
-            response = requests.request(method, url, *args, **kwargs)
+            response = self.session.request(method, url, *args, **kwargs)
 
         except requests.exceptions.RequestException as e:
             self.log.critical("Error connection to API: {} - {}"\
                                .format(type(e).__name__, e))
+            self.metrics.request(method, path, 'error',
+                                 total=time.time() - start)
+            self.errors = self.errors + 1
             return None, None
 
+        ttfb = time.time() - start
+        if stream:
+            self.metrics.request(method, path, response.status_code,
+                                 ttfb=ttfb)
+        else:
+            body = response.content
+            transfer = time.time() - start - ttfb
+
         try:
             response.raise_for_status()
 
         except Exception:
-            self.log.error("Error in response: {} {}".format(
+            if response.status_code in expect:
+                self.log.debug("Response: {} {}".format(
                         response.status_code,
                         self.status_code_to_string(response.status_code)))
-            if 'x-request-error' in response.headers:
-                self.log.error("Message: {}"\
-                        .format(response.headers['x-request-error']))
+
+            else:
+                self.errors = self.errors + 1
+                self.log.error("Error in response: {} {}".format(
+                        response.status_code,
+                        self.status_code_to_string(response.status_code)))
+                if 'x-request-error' in response.headers:
+                    self.log.error("Message: {}"\
+                            .format(response.headers['x-request-error']))
 
             self.print_headers(response.headers)
+            if not stream:
+                self.metrics.request(method, path, response.status_code,
+                                     ttfb=ttfb, transfer=transfer,
+                                     total=time.time() - start)
 
             return response, None
 
         else:
             self.print_headers(response.headers)
+            if method.lower() not in ('get', 'head'):
+                for callback in self.on_change:
+                    callback(method, path)
 
             if not quiet:
                 self.log.info("OK {} {}".format(response.status_code,
                             self.status_code_to_string(response.status_code)))
+            if cached and response.status_code == httplib.NOT_MODIFIED:
+                self.cache.hit()
+                body = cached.body
+
+            # not modified responses (to conditional requests) have no body
+            elif stream or response.status_code == httplib.NOT_MODIFIED:
+                if not stream:
+                    self.metrics.request(method, path, response.status_code,
+                                         ttfb=ttfb, transfer=transfer,
+                                         total=time.time() - start)
+                return response, None
+
+            else:
+                if self.cache and method.lower() == 'get':
+                    self.cache.miss()
+                    self.cache.store(url, response.headers, body)
+
+            decoding = time.time()
             try:
-                content = json.loads(response.content)
-                if self.log.getEffectiveLevel() == logging.DEBUG and not quiet:
-                    sys.stderr.write(json.dumps(content,
-                                                sort_keys=True,
-                                                indent=4))
-                    sys.stderr.write("\n\n")
-                    sys.stderr.flush()
+                # body is decoded as bytes, the codecs handle utf-8 directly
+                content = self.codec.loads(body)
+                decode = time.time() - decoding
+                if not quiet:
+                    self.log.debug("Response\t:\n%s\n",
+                                   codec.Pretty(content, body,
+                                                self.debug_body_size))
 
             except (AttributeError, ValueError) as e:
                 if int(response.headers['content-length']) != 0:
                     self.log.error("Cannot decode json: %s", e)
                 content = None
+                decode = None
 
+            self.metrics.request(method, path, response.status_code,
+                                 ttfb=ttfb, transfer=transfer, decode=decode,
+                                 total=time.time() - start)
             return response, content
 
     def post(self, url, data, **kwargs):
@@ -197,55 +437,438 @@ class AybuManagerClient(object):
     def get(self, url, **kwargs):
         return self.request('get', url, **kwargs)
 
+    def iter_items(self, url, chunk_size=8192, **kwargs):
+        """ GET a json object, yielding its (key, value) pairs while the
+            body is being received, so that large collections can be
+            processed before the download completes.
+        """
+        full_url = self.url(url, kwargs.get('query_params'))
+        cached = None
+        if self.cache and not kwargs.get('headers'):
+            cached = self.cache.get(full_url)
+            if cached:
+                kwargs['headers'] = cached.validators()
+
+        response, content = self.request('get', url, stream=True, **kwargs)
+        if cached and response is not None and \
+           response.status_code == httplib.NOT_MODIFIED:
+            self.cache.hit()
+            chunks = [cached.body]
+
+        elif response is None or not response.ok or \
+             response.status_code in (httplib.NO_CONTENT,
+                                      httplib.NOT_MODIFIED):
+            return
+
+        else:
+            chunks = response.iter_content(chunk_size)
+            if self.cache:
+                self.cache.miss()
+                if self.cache.cacheable(response.headers):
+                    chunks = self.caching(full_url, response.headers, chunks)
+
+        try:
+            for item in jsonstream.iter_items(chunks):
+                yield item
+
+        except ValueError as e:
+            self.log.error("Cannot decode json: %s", e)
+
+    def caching(self, url, headers, chunks):
+        """ Yield chunks, storing the whole body in the cache once they
+            have all been received.
+        """
+        body = []
+        for chunk in chunks:
+            body.append(chunk)
+            yield chunk
+        self.cache.store(url, headers, ''.join(body))
+
     def execute_task(self, method, *args, **kwargs):
+        """ Submit a task. The messages of its uuid are followed from now
+            on, unless it is not going to run now (failed or deferred):
+            the caller waiting for it is to forget it.
+        """
+        uuid = self.uuid()
+        waiting = False
         try:
-            uuid = self.uuid()
+            if not self.subscription.wait_ready():
+                log.debug("Subscription not ready, messages may be lost")
             headers = {'X-Task-UUID': uuid}
+            self.metrics.task_submitted(uuid, method, args[0], time.time())
             response, content = self.request(method, *args, headers=headers,
                                              **kwargs)
+            if not response or not response.ok:
+                self.metrics.task_finished(uuid, 'ERROR')
+                self.task_changed(uuid, 'ERROR', method, args[0])
+
+            else:
+                self.task_changed(uuid, response.headers['x-task-status'],
+                                  method, args[0])
+
             if response:
                 response.raise_for_status()
-
-                log.info("Task {}: {}".format(response.headers['x-task-uuid'],
-                                            response.headers['x-task-status']))
+                self.metrics.task_accepted(uuid)
+                if response.headers['x-task-status'] == 'DEFERRED':
+                    self.metrics.task_finished(uuid, 'DEFERRED')
+                else:
+                    waiting = True
+
+                log.info("Task {}: {}".format(
+                            response.headers['x-task-uuid'],
+                            response.headers['x-task-status']))
             return response
 
         finally:
-            self.counter = self.counter + 1
+            # tasks_wait follows deferred tasks again when waiting for them
+            if not waiting:
+                self.subscription.forget(uuid)
+
+    def task_changed(self, uuid, status, method=None, path=None):
+        for callback in self.on_task:
+            callback(uuid, status, method, path)
+
+    def read_message(self, timeout, uuid=None):
+        """ Wait up to timeout seconds for a message on the subscription
+            socket, of task uuid only if given.
+            Returns (task uuid, level, message) or None.
+        """
+        return self.subscription.recv(timeout, uuid)
+
+    def log_message(self, uuid, level, msg):
+        topic = "{}.{}".format(uuid, level)
+        try:
+            getattr(log, level.lower())("%s: %s", topic, msg)
+
+        except (AttributeError, TypeError):
+            log.info("%s: %s", topic, msg)
+
+    def task_status(self, uuid):
+        """ Ask the server for the status of a task, UNKNOWN if it has
+            none of it (i.e. it was flushed)
+        """
+        response, content = self.get('/tasks/{}'.format(uuid), quiet=True,
+                                     expect=(httplib.NOT_FOUND, ))
+        if response is not None and \
+           response.status_code == httplib.NOT_FOUND:
+            return 'UNKNOWN'
+        return (content or {}).get('status')
+
+    def backfill(self, uuid, seen):
+        """ Log the messages of a task that were missed on the
+            subscription, fetching them from /tasks/<uuid>/logs.
+        """
+        response, content = self.get('/tasks/{}/logs'.format(uuid),
+                                     quiet=True, expect=(httplib.NOT_FOUND, ))
+        # every message received accounts for one log line
+        seen = collections.Counter(seen)
+        for line in content or []:
+            line = line.rstrip("\r\n")
+            # log lines are formatted as "<LEVEL>: <message>"
+            prefix, sep, text = line.partition(": ")
+            text = (text if sep else line).strip()
+            if seen[text]:
+                seen[text] = seen[text] - 1
+                continue
+            log.info("%s: %s", uuid, line.strip())
+
+    def wait_task(self, uuid, task_timeout=None, ready=True):
+        """ Log the messages published by a task until it finishes and
+            return its final status. If nothing is received for
+            heartbeat_interval seconds the status is polled over HTTP.
+            Raises TaskTimeout when task_timeout (or the client's
+            task_timeout) seconds elapse.
+            Messages may have been lost if the subscription was not ready
+            when the task was submitted, or if the task finished without us
+            receiving any message: in that case they are backfilled.
+        """
+        import zmq
+        timeout = task_timeout or self.task_timeout
+        deadline = time.time() + timeout if timeout else None
+        last_seen = time.time()
+        subscribed = True
+        status = None
+        seen = []
+
+        try:
+            while True:
+                now = time.time()
+                if deadline and now >= deadline:
+                    raise TaskTimeout("Task {} did not finish within {}s "
+                                      "(last known status: {})"\
+                                      .format(uuid, timeout,
+                                              status or 'unknown'))
+
+                wait = max(self.heartbeat_interval - (now - last_seen), 0)
+                if deadline:
+                    wait = min(wait, deadline - now)
+
+                message = None
+                if subscribed:
+                    try:
+                        message = self.read_message(wait, uuid)
+
+                    except zmq.ZMQError as e:
+                        log.error("Error while reading from subscription: "
+                                  "%s, polling task status", e)
+                        subscribed = False
+
+                else:
+                    time.sleep(wait)
+
+                if message:
+                    last_seen = time.time()
+                    msg_uuid, level, msg = message
+                    if msg_uuid != uuid:
+                        continue
+
+                    if level == 'finished':
+                        if not ready or not seen:
+                            self.backfill(uuid, seen)
+                        return 'FINISHED'
+
+                    seen.append(msg)
+                    self.log_message(msg_uuid, level, msg)
+
+                elif time.time() - last_seen >= self.heartbeat_interval:
+                    log.debug("No messages for %s in %ss, polling its status",
+                              uuid, self.heartbeat_interval)
+                    last_seen = time.time()
+                    status = self.task_status(uuid)
+                    if status and status not in self.pending_statuses:
+                        self.backfill(uuid, seen)
+                        log.info("Task %s: %s", uuid, status)
+                        return status
+
+        finally:
+            self.subscription.forget(uuid)
 
     def execute_sync_task(self, method, *args, **kwargs):
+        task_timeout = kwargs.pop('task_timeout', None)
+        response = self.execute_task(method, *args, **kwargs)
+        if not response:
+            return response
+
+        if response.headers['x-task-status'] == 'DEFERRED':
+            log.info("Use tasks_wait %s to wait for it",
+                     response.headers['x-task-uuid'])
+            return response
+
+        uuid = response.headers['x-task-uuid']
+        try:
+            status = self.wait_task(uuid, task_timeout,
+                                    ready=self.subscription.ready)
+            self.metrics.task_finished(uuid, status)
+            self.task_changed(uuid, status)
+
+        except TaskTimeout:
+            self.metrics.task_finished(uuid, 'TIMEOUT')
+            self.task_changed(uuid, 'TIMEOUT')
+            raise
+
+        except KeyboardInterrupt:
+            log.info("Not waiting for task %s anymore",
+                     response.headers['x-task-uuid'])
+
+        return response
+
+    def execute_tasks(self, method, tasks, concurrency=10, task_timeout=None,
+                      on_done=None):
+        """ Submit many tasks at once, keeping at most concurrency of them
+            running, and collect their completions on the subscription
+            socket. tasks is an iterable of (key, url, request kwargs);
+            returns a dict that maps every key to the final task status.
+            on_done(key, status) is called as every task completes, in
+            place of logging it.
+        """
+        pending = collections.deque(tasks)
+        running = {}
+        started = {}
+        queued = set()
+        failed = set()
+        results = {}
+        total = len(pending)
+        submitted = Queue.Queue()
+        timeout = task_timeout or self.task_timeout
+        # when a message of each task was last received, or its status
+        # polled, as in wait_tasks
+        last_seen = {}
+
+        def submit(uuid, url, kwargs):
+            try:
+                response, content = self.request(method, url, quiet=True,
+                                            headers={'X-Task-UUID': uuid},
+                                            **kwargs)
+                status = response.headers['x-task-status'] if response \
+                         else 'ERROR'
+                if response:
+                    self.metrics.task_accepted(uuid)
+
+            except Exception as e:
+                self.log.error("Cannot submit task %s: %s", uuid, e)
+                status = 'ERROR'
+
+            submitted.put((uuid, status))
+
+        def done(uuid, status):
+            key = running.pop(uuid)
+            queued.discard(uuid)
+            last_seen.pop(uuid, None)
+            self.subscription.forget(uuid)
+            if uuid in failed and status == 'FINISHED':
+                status = 'FAILED'
+            results[key] = status
+            self.metrics.task_finished(uuid, status)
+            self.task_changed(uuid, status)
+            if on_done:
+                on_done(key, status)
+            else:
+                self.log.info("[%d/%d] %s: %s", len(results), total, key,
+                              status)
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(concurrency)
         try:
-            response = self.execute_task(method, *args, **kwargs)
-            if not response:
-                return
+            while pending or running:
+                while pending and len(running) < concurrency:
+                    key, url, kwargs = pending.popleft()
+                    uuid = self.uuid()
+                    running[uuid] = key
+                    started[uuid] = last_seen[uuid] = time.time()
+                    self.subscription.wait_ready()
+                    self.metrics.task_submitted(uuid, method, url,
+                                                started[uuid])
+                    self.task_changed(uuid, 'UNDEFINED', method, url)
+                    pool.apply_async(submit, (uuid, url, kwargs))
+
+                while True:
+                    try:
+                        uuid, status = submitted.get_nowait()
+
+                    except Queue.Empty:
+                        break
+
+                    if uuid not in running:
+                        continue
+
+                    # a task that is not going to publish a finished
+                    # message is done as soon as it has been submitted
+                    if status in ('ERROR', 'DEFERRED'):
+                        done(uuid, status)
+                    else:
+                        queued.add(uuid)
+
+                now = time.time()
+                if timeout:
+                    for uuid in [u for u in running
+                                 if now - started[u] > timeout]:
+                        done(uuid, 'TIMEOUT')
+
+                for uuid in [u for u in queued
+                             if now - last_seen[u] > self.heartbeat_interval]:
+                    last_seen[uuid] = time.time()
+                    status = self.task_status(uuid)
+                    if status and status not in self.pending_statuses:
+                        done(uuid, status)
+
+                message = self.read_message(0.1)
+                if not message:
+                    continue
+
+                uuid, level, msg = message
+                if uuid not in running:
+                    continue
 
-            if response.headers['x-task-status'] == 'DEFERRED':
-                return response
+                last_seen[uuid] = time.time()
 
-            while True:
-                try:
-                    message = self.zmq_response_socket.recv_multipart()
-                    topic, msg = message
-                    msg = msg.strip()
+                if level == 'finished':
+                    done(uuid, 'FINISHED')
+
+                elif level and level.upper() in ('ERROR', 'CRITICAL'):
+                    failed.add(uuid)
+                    self.log.error("%s: %s", running[uuid], msg)
+
+        finally:
+            pool.close()
+            pool.join()
+            for uuid in running:
+                self.subscription.forget(uuid)
+
+        return results
+
+    def wait_tasks(self, uuids, task_timeout=None, on_done=None):
+        """ Wait for many tasks submitted earlier, following all of them
+            on the subscription socket. Their status is polled over HTTP
+            once the subscription is ready, as they may be over already,
+            then the status of every task that sends no message for
+            heartbeat_interval seconds. Returns a dict that maps every
+            uuid to its final status, TIMEOUT for those still running
+            after task_timeout seconds. on_done(uuid, status) is called
+            as every task completes.
+        """
+        running = set(uuids)
+        failed = set()
+        results = {}
+        timeout = task_timeout or self.task_timeout
+        deadline = time.time() + timeout if timeout else None
+
+        def done(uuid, status):
+            running.discard(uuid)
+            self.subscription.forget(uuid)
+            if uuid in failed and status == 'FINISHED':
+                status = 'FAILED'
+            results[uuid] = status
+            self.task_changed(uuid, status)
+            if on_done:
+                on_done(uuid, status)
+
+        def poll(uuids):
+            for uuid in uuids:
+                last_seen[uuid] = time.time()
+                status = self.task_status(uuid)
+                if status and status not in self.pending_statuses:
+                    done(uuid, status)
 
-                except KeyboardInterrupt:
-                    raise
+        try:
+            for uuid in running:
+                self.subscription.follow(uuid)
+            self.subscription.wait_ready()
+            # when a message of each task was last received, or its
+            # status polled: the finished message of a task can be lost
+            # while the others keep publishing
+            last_seen = {}
+            poll(list(running))
+            while running:
+                now = time.time()
+                if deadline and now >= deadline:
+                    for uuid in list(running):
+                        done(uuid, 'TIMEOUT')
+                    break
+
+                silent = [uuid for uuid in running
+                          if now - last_seen[uuid] > self.heartbeat_interval]
+                if silent:
+                    poll(silent)
+                    continue
 
-                except:
-                    log.exception("Error while reading from subscription")
+                message = self.read_message(0.5)
+                if not message:
                     continue
 
-                topic_parts = topic.split(".")
-                topic = '.'.join(topic_parts)
+                uuid, level, msg = message
+                if uuid not in running:
+                    continue
 
-                try:
-                    level = topic_parts[-1:][0]
-                    getattr(log, level.lower())("%s: %s", topic, msg)
+                last_seen[uuid] = time.time()
+                if level == 'finished':
+                    done(uuid, 'FINISHED')
 
-                except (AttributeError, IndexError):
-                    if level == 'finished':
-                        raise KeyboardInterrupt
-                    log.info("%s: %s", topic, msg)
+                elif level and level.upper() in ('ERROR', 'CRITICAL'):
+                    failed.add(uuid)
+                    self.log.error("%s: %s", uuid, msg)
 
-        except KeyboardInterrupt:
-            pass
+        finally:
+            for uuid in running:
+                self.subscription.forget(uuid)
+
+        return results
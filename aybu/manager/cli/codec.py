@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import importlib
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+# json libraries, fastest first. All of them decode a utf-8 byte string
+# as it is, without decoding the whole document to unicode first, and
+# raise ValueError (or a subclass) on invalid documents.
+names = ('ujson', 'simplejson', 'json')
+
+
+def available():
+    """ The names of the json libraries that can be imported """
+    res = []
+    for name in names:
+        try:
+            importlib.import_module(name)
+
+        except ImportError:
+            continue
+
+        res.append(name)
+    return res
+
+
+def get(name=None):
+    """ The json module called name, or the fastest one installed """
+    if name:
+        if name not in names:
+            raise ValueError("Unknown json codec {}".format(name))
+        return importlib.import_module(name)
+
+    for name in names:
+        try:
+            return importlib.import_module(name)
+
+        except ImportError:
+            log.debug("%s is not installed", name)
+
+
+class Pretty(object):
+    """ The indented json of a decoded document, to be passed as a logging
+        argument: it is only formatted if the record is emitted. Documents
+        whose body is larger than max_size bytes are shown as received,
+        truncated, since encoding them again would cost as much as
+        decoding them.
+    """
+
+    def __init__(self, content, body, max_size=65536):
+        self.content = content
+        self.body = body
+        self.max_size = max_size
+
+    def __str__(self):
+        if len(self.body) > self.max_size:
+            return "{}... ({} more bytes)".format(
+                        self.body[:self.max_size],
+                        len(self.body) - self.max_size)
+        return json.dumps(self.content, sort_keys=True, indent=4)
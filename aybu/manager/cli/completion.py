@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import bisect
+import ConfigParser
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from . import manifest
+from . output import Output
+
+log = logging.getLogger(__name__)
+
+# the values the arguments of the builtin commands can take
+builtin_choices = {
+    'set_output': Output.formats,
+    'set_log_level': ('debug', 'info', 'warning', 'error', 'critical'),
+    'keep_warm': ('on', 'off'),
+    'profile': ('on', 'off')
+}
+
+
+def cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'aybu_manager_cli')
+
+
+class CompletionIndex(object):
+    """ A sorted list of keys, supporting prefix lookups by bisection """
+
+    def __init__(self, keys=()):
+        self.keys = sorted(keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def startswith(self, prefix):
+        res = []
+        for i in xrange(bisect.bisect_left(self.keys, prefix), len(self.keys)):
+            if not self.keys[i].startswith(prefix):
+                break
+            res.append(self.keys[i])
+        return res
+
+
+class CompletionCache(object):
+    """ Holds a CompletionIndex for every interface, built from its
+        get_list() and valid for ttl seconds.
+    """
+    log = log
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, interface):
+        with self.lock:
+            entry = self.entries.get(interface.name)
+
+        if not entry or time.time() - entry[0] > self.ttl:
+            return self.refresh(interface)
+
+        return entry[2]
+
+    def refresh(self, interface):
+        try:
+            index = CompletionIndex(interface.get_list(quiet=True,
+                                                       debug=False))
+
+        except Exception as e:
+            self.log.debug("Cannot refresh completions for %s: %s",
+                           interface.name, e)
+            index = CompletionIndex()
+
+        with self.lock:
+            self.entries[interface.name] = (time.time(), interface.root_url,
+                                            index)
+        return index
+
+    def invalidate(self, method, path):
+        """ Drop the entries of every collection touched by path """
+        with self.lock:
+            for name, (ts, root_url, index) in self.entries.items():
+                if path == root_url or path.startswith(root_url + "/"):
+                    self.log.debug("Invalidating %s completions", name)
+                    del self.entries[name]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def warm(self, interfaces):
+        """ Fill the cache in a background thread """
+        def run():
+            for interface in interfaces:
+                self.refresh(interface)
+
+        thread = threading.Thread(target=run, name='completion-warmup')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class CompletionFile(object):
+    """ The on-disk completion index of a remote: command names and the
+        keys of every collection, with the validators (ETag, Last-Modified)
+        used to refresh them with conditional requests.
+        It is read by the shell completion entry point, which must not
+        import requests nor zmq.
+    """
+    log = log
+
+    def __init__(self, remote, path=None):
+        self.remote = remote
+        self.path = path or os.path.join(cache_dir(),
+                                         '{}.json'.format(remote))
+        self.data = dict(updated=0, commands=[], collections={})
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+
+        except (IOError, ValueError):
+            pass
+
+        return self
+
+    def save(self):
+        self.data['updated'] = time.time()
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # write and rename, readers never see a partial file
+        tmp = "{}.{}".format(self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f, separators=(',', ':'))
+        os.rename(tmp, self.path)
+
+    def stale(self, ttl):
+        return time.time() - self.data['updated'] > ttl
+
+    @property
+    def commands(self):
+        return self.data['commands'] or manifest.commands()
+
+    @commands.setter
+    def commands(self, commands):
+        self.data['commands'] = sorted(commands)
+
+    def keys(self, name):
+        return self.data['collections'].get(name, {}).get('keys', [])
+
+    def validators(self, name):
+        """ Headers for a conditional request for the collection name """
+        collection = self.data['collections'].get(name, {})
+        headers = {}
+        if collection.get('etag'):
+            headers['If-None-Match'] = collection['etag']
+        if collection.get('last_modified'):
+            headers['If-Modified-Since'] = collection['last_modified']
+        return headers
+
+    def update(self, name, keys, etag=None, last_modified=None):
+        self.data['collections'][name] = dict(keys=sorted(keys), etag=etag,
+                                              last_modified=last_modified)
+
+    def refresh_in_background(self, configfile=None, delay=60):
+        """ Run completion_refresh in a detached process, unless one has
+            been started in the last delay seconds.
+        """
+        import subprocess
+        marker = "{}.refreshing".format(self.path)
+        try:
+            if time.time() - os.path.getmtime(marker) < delay:
+                return
+
+        except OSError:
+            pass
+
+        try:
+            if not os.path.isdir(os.path.dirname(marker)):
+                os.makedirs(os.path.dirname(marker))
+            open(marker, 'w').close()
+            cli = os.path.join(os.path.dirname(sys.argv[0]),
+                               'aybu_manager_cli')
+            if not os.path.exists(cli):
+                cli = 'aybu_manager_cli'
+            args = [cli, '-R', self.remote]
+            if configfile:
+                args.extend(['-F', configfile])
+            args.append('completion_refresh')
+            with open(os.devnull, 'r+') as devnull:
+                subprocess.Popen(args, stdin=devnull, stdout=devnull,
+                                 stderr=devnull, close_fds=True,
+                                 preexec_fn=os.setsid)
+
+        except (IOError, OSError) as e:
+            self.log.debug("Cannot refresh completions: %s", e)
+
+
+def remotes(configfile=None):
+    """ The names of the remotes, the sections of configfile """
+    config = ConfigParser.ConfigParser()
+    try:
+        with open(os.path.expanduser(configfile or
+                                     '~/.aybu_manager_cli.conf')) as f:
+            config.readfp(f)
+
+    except (IOError, ConfigParser.Error):
+        return []
+
+    return config.sections()
+
+
+def main(argv=None, ttl=300):
+    """ Shell completion entry point, called as
+        aybu_manager_complete $COMP_CWORD "${COMP_WORDS[@]}"
+        Prints the candidates for the current word, one per line.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    try:
+        cword = int(argv[0])
+
+    except (IndexError, ValueError):
+        return
+
+    words = argv[1:]
+    cur = words[cword] if cword < len(words) else ''
+    prev = words[cword - 1] if 0 < cword <= len(words) else ''
+    remote = 'default'
+    configfile = None
+    for i, word in enumerate(words[:cword - 1]):
+        if word in ('-R', '--remote'):
+            remote = words[i + 1]
+        elif word in ('-F', '--configfile'):
+            configfile = words[i + 1]
+
+    index = CompletionFile(remote).load()
+    if index.stale(ttl):
+        index.refresh_in_background(configfile)
+
+    commands = index.commands
+    if prev in ('connect', '-R', '--remote'):
+        candidates = remotes(configfile)
+
+    elif prev == 'help':
+        candidates = commands
+
+    elif prev in manifest.builtins:
+        candidates = builtin_choices.get(prev, [])
+
+    elif prev in commands and "_" in prev:
+        name, command = prev.split("_", 1)
+        if command in ('list', 'create', 'deploy') or command.endswith('_all'):
+            candidates = []
+        else:
+            candidates = index.keys(name)
+
+    elif prev in ('-F', '--configfile'):
+        candidates = []
+
+    else:
+        candidates = commands
+
+    for candidate in candidates:
+        if candidate.startswith(cur):
+            sys.stdout.write("{}\n".format(candidate))
@@ -21,7 +21,6 @@ from . interface import BaseInterface
 
 
 class EnvironmentInterface(BaseInterface):
-    commands = ['list', 'create', 'delete', 'rename', 'info', 'rewrite']
     name = 'envs'
     root_url = '/environments'
 
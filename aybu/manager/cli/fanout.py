@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from StringIO import StringIO
+from . output import Output
+
+log = logging.getLogger(__name__)
+
+Result = namedtuple('Result', ('remote', 'ok', 'elapsed', 'error'))
+
+
+class RemotesFailed(Exception):
+    pass
+
+
+class RemoteFilter(logging.Filter):
+    """ Prefix the messages logged while running a command against one of
+        many remotes with the name of the remote
+    """
+
+    def __init__(self, main):
+        logging.Filter.__init__(self)
+        self.main = main
+
+    def filter(self, record):
+        remote = getattr(getattr(self.main, 'local', None), 'remote', None)
+        if remote:
+            record.msg = "[%s] %s" % (remote, record.msg)
+        return True
+
+
+class FanOut(object):
+    """ Run a command against several remotes at once. Each remote gets its
+        own thread, with the client returned by client(remote) and its own
+        buffered output, as in Batch.run_parallel. Once all of them are
+        done, or timeout seconds have passed, their output is merged with
+        the remote as the first column.
+    """
+    log = log
+
+    def __init__(self, main, consume, client, timeout=None):
+        self.main = main
+        self.consume = consume
+        self.client = client
+        self.timeout = timeout
+
+    def execute(self, remote, arglist):
+        main = self.main
+        main.local.remote = remote
+        try:
+            client = main.local.api_client = self.client(remote)
+            errors = client.errors
+            cmd, result = self.consume(list(arglist))
+            if hasattr(result, 'next'):
+                for value in result:
+                    pass
+
+            # commands log failed requests rather than raising
+            if client.errors > errors:
+                return "{} requests failed".format(client.errors - errors)
+
+        except SystemExit as e:
+            # raised by argparse on invalid arguments
+            if e.code not in (0, None):
+                return str(e.code)
+
+        except Exception as e:
+            return "{}: {}".format(type(e).__name__, e)
+
+        finally:
+            main.local.output.flush()
+            del main.local.remote
+            main.local.api_client = None
+
+    def run(self, remotes, arglist):
+        """ Run arglist against remotes, writing the merged output to the
+            output of main. Returns the list of failed Results.
+        """
+        output = self.main.output
+        outputs = [Output(output.format, stream=StringIO(),
+                          flush_interval=None) for remote in remotes]
+        results = [None] * len(remotes)
+        start = time.time()
+
+        def run(i):
+            self.main.local.output = outputs[i]
+            try:
+                error = self.execute(remotes[i], arglist)
+                results[i] = Result(remotes[i], error is None,
+                                    time.time() - start, error)
+
+            finally:
+                del self.main.local.output
+
+        threads = [threading.Thread(target=run, args=(i, ),
+                                    name='remote-{}'.format(remote))
+                   for i, remote in enumerate(remotes)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        deadline = start + self.timeout if self.timeout else None
+        for thread in threads:
+            # join with a timeout, so that ctrl-c is not ignored
+            while thread.is_alive() and \
+                  (not deadline or time.time() < deadline):
+                thread.join(0.5 if not deadline else
+                            max(min(deadline - time.time(), 0.5), 0))
+
+        # the output of remotes that timed out is left out, as incomplete
+        self.merge(output, [(remote, out) for remote, out, result
+                            in zip(remotes, outputs, results) if result])
+        results = [r or Result(remote, False, time.time() - start,
+                               "timed out after {}s".format(self.timeout))
+                   for r, remote in zip(results, remotes)]
+
+        for result in results:
+            if result.ok:
+                self.log.debug("[OK] %s (%.2fs)", result.remote,
+                               result.elapsed)
+            else:
+                self.log.error("[FAILED] %s: %s (%.2fs)", result.remote,
+                               result.error, result.elapsed)
+        return [r for r in results if not r.ok]
+
+    def merge(self, output, outputs):
+        """ Write the outputs of every remote, a list of (remote, Output),
+            to output:
+                table: every line is prefixed by the remote
+                json:  a document mapping each remote to its document
+                jsonl: every record has a remote attribute
+                tsv:   a remote column is added, the header written once
+        """
+        width = max([len(remote) for remote, o in outputs] or [0])
+        header = None
+        if output.format == 'json':
+            output.write('{')
+
+        for i, (remote, out) in enumerate(outputs):
+            text = out.stream.getvalue()
+            if output.format == 'json':
+                output.write('{}\n{}: {}'.format(',' if i else '',
+                                                 json.dumps(remote),
+                                                 text.strip() or 'null'))
+                continue
+
+            for line in text.splitlines():
+                if output.format == 'table':
+                    output.writeline("{} {}".format(remote.ljust(width),
+                                                    line))
+
+                elif output.format == 'jsonl':
+                    record = line[1:].strip()
+                    output.writeline('{{"remote": {}{}{}'.format(
+                                        json.dumps(remote),
+                                        ", " if record != "}" else "",
+                                        record))
+
+                elif line == out.header:
+                    # remotes may return different columns
+                    if line != header:
+                        header = line
+                        output.writeline("remote\t{}".format(line))
+
+                else:
+                    output.writeline("{}\t{}".format(remote, line))
+
+        if output.format == 'json':
+            output.writeline('\n}')
+        output.flush()
@@ -21,7 +21,6 @@ from . interface import BaseInterface
 
 
 class GroupInterface(BaseInterface):
-    commands = ['list', 'create', 'update', 'info', 'delete']
     name = 'groups'
 
     @plac.annotations(
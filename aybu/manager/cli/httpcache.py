@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import urlparse
+from collections import namedtuple, OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class Entry(namedtuple('Entry', ('url', 'etag', 'last_modified', 'body'))):
+
+    @property
+    def path(self):
+        return urlparse.urlparse(self.url).path
+
+    def validators(self):
+        """ The headers making a conditional request for this entry """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HTTPCache(object):
+    """ The bodies of GET responses carrying an ETag or a Last-Modified
+        header, kept to be revalidated with conditional requests. Entries
+        are kept in memory up to max_size bytes, evicting the least
+        recently used ones, and in directory if given.
+    """
+    log = log
+
+    def __init__(self, max_size=16 * 1024 * 1024, directory=None):
+        self.max_size = max_size
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def filename(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url).hexdigest())
+
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.pop(url, None)
+            if entry:
+                self.entries[url] = entry
+                return entry
+
+        if self.directory:
+            entry = self.load(url)
+            if entry:
+                self.add(entry)
+        return entry
+
+    def load(self, url):
+        """ Read the entry of url from disk: a json line of metadata
+            followed by the body.
+        """
+        try:
+            with open(self.filename(url), 'rb') as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+
+        except (IOError, ValueError):
+            return None
+
+        if meta.get('url') != url:
+            return None
+        return Entry(url, meta.get('etag'), meta.get('last_modified'), body)
+
+    def save(self, entry):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            filename = self.filename(entry.url)
+            tmp = "{}.{}".format(filename, os.getpid())
+            with open(tmp, 'wb') as f:
+                f.write(json.dumps(dict(url=entry.url, etag=entry.etag,
+                                        last_modified=entry.last_modified)))
+                f.write("\n")
+                f.write(entry.body)
+            os.rename(tmp, filename)
+
+        except (IOError, OSError) as e:
+            self.log.debug("Cannot save %s in cache: %s", entry.url, e)
+
+    def add(self, entry):
+        if len(entry.body) > self.max_size:
+            return
+
+        with self.lock:
+            old = self.entries.pop(entry.url, None)
+            if old:
+                self.size = self.size - len(old.body)
+            self.entries[entry.url] = entry
+            self.size = self.size + len(entry.body)
+            while self.size > self.max_size:
+                url, evicted = self.entries.popitem(last=False)
+                self.size = self.size - len(evicted.body)
+                self.evictions = self.evictions + 1
+
+    def cacheable(self, headers):
+        return bool(headers.get('etag') or headers.get('last-modified'))
+
+    def store(self, url, headers, body):
+        """ Keep body, the response to url, if headers allow to
+            revalidate it.
+        """
+        if not self.cacheable(headers):
+            return
+
+        entry = Entry(url, headers.get('etag'), headers.get('last-modified'),
+                      body)
+        self.add(entry)
+        if self.directory:
+            self.save(entry)
+
+    def hit(self):
+        with self.lock:
+            self.hits = self.hits + 1
+
+    def miss(self):
+        with self.lock:
+            self.misses = self.misses + 1
+
+    def invalidate(self, method, path):
+        """ Drop the entries of path, of the resources below it and of the
+            collections containing it, as a request changing path may
+            have changed all of them.
+        """
+        path = path.split("?")[0].rstrip("/")
+        with self.lock:
+            for url, entry in self.entries.items():
+                cached = entry.path.rstrip("/")
+                if cached == path or cached.startswith(path + "/") or \
+                   path.startswith(cached + "/"):
+                    del self.entries[url]
+                    self.size = self.size - len(entry.body)
+                    self.invalidations = self.invalidations + 1
+                    if self.directory:
+                        try:
+                            os.unlink(self.filename(url))
+
+                        except OSError:
+                            pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return OrderedDict((('entries', len(self.entries)),
+                            ('size', self.size),
+                            ('hits', self.hits),
+                            ('misses', self.misses),
+                            ('evictions', self.evictions),
+                            ('invalidations', self.invalidations)))
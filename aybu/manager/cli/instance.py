@@ -16,52 +16,87 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import fnmatch
+import math
+import os
 import plac
+import time
 from . interface import BaseInterface
 from . archive import ArchiveInterface
 
 
+rolling_options = dict(
+    wave=('Reload WAVE instances at a time, a number or a percentage',
+          'option', 'w', str, None, 'WAVE'),
+    by_env=('Make waves of instances of the same environment', 'flag', 'e'),
+    probe=('After each wave, GET URL until it answers (the domain is '
+           'substituted to {domain}), i.e. http://{domain}/', 'option', 'p',
+           str, None, 'URL'),
+    max_failures=('Abort if more than RATE (0-1) of a wave fails', 'option',
+                  'x', float, None, 'RATE'),
+    timeout=('Give up on tasks running for more than SECONDS', 'option',
+             't', float, None, 'SECONDS')
+)
+
+
 class InstanceInterface(BaseInterface):
 
-    commands = ['list', 'deploy', 'delete', 'enable', 'disable', 'flush',
-                'switch_env', 'reload', 'reload_all', 'rewrite', 'rewrite_all',
-                'delete', 'archive', 'restore', 'info', 'migrate', 'kill',
-                'force_reload', 'change_domain', 'groups_add', 'groups_remove',
-                'groups_empty', 'groups_set', 'allowed_users', 'migrate_all']
     name = 'instances'
+    key_name = 'domain'
+    actions = {
+        'enable': dict(action='enable'),
+        'disable': dict(action='disable'),
+        'flush': dict(action='flush_cache'),
+        'reload': dict(action='reload'),
+        'force_reload': dict(action='reload', force='true'),
+        'kill': dict(action='reload', kill='true'),
+        'rewrite': dict(action='rewrite'),
+        'migrate': dict(action='migrate')
+    }
 
     @plac.annotations(
         full=('Get complete output', 'flag', 'f'),
-        verbose=('Be verbose', 'flag', 'v')
+        verbose=('Be verbose', 'flag', 'v'),
+        page_size=('Fetch N instances per request', 'option', 'p', int,
+                   None, 'N'),
+        fields=('Attributes to fetch (comma separated)', 'option', 'a',
+                str, None, 'FIELDS')
     )
-    def list(self, full=False, verbose=False, **attributes):
+    def list(self, full=False, verbose=False, page_size=None, fields=None,
+             **attributes):
         """ List instances. Add every search query at the end, using
             field=value.
             i.e. instances_list onwer_email=user@example.com sort_by=domain
+            Instances are printed while they are received when paging
+            (-p) or sorting on the server (sort_by).
         """
-        quiet = not verbose
-        response, content = self.api.get(self.root_url, quiet=quiet,
-                                         query_params=attributes)
-
-        if not full and content:
-            self.log.info("environment  disabled  domain")
-            self.log.info("-----------  --------  %s", "-" * 32)
-
-        content = content or {}
-        keys = sorted(content) if not 'sort_by' in attributes else content
-
-        for res in keys:
-            marker = ''
-            if content[res]['enabled'] == False:
-                marker = 'x'
-
-            if full:
-                self.log.info(" • {}".format(res))
-                self.print_info(content[res], prompt='   ° ')
-
-            else:
-                self.log.info("{1:^11}  {2:^8}  {0}"\
-                        .format(res, content[res]['environment_name'], marker))
+        if not full and not fields:
+            # the short listing only needs these attributes
+            fields = 'environment_name,enabled'
+            projection = False
+
+        else:
+            projection = not full
+
+        items = self.iter_list(page_size=page_size, fields=fields,
+                               quiet=not verbose, **attributes)
+        if not page_size and not 'sort_by' in attributes:
+            items = sorted(items)
+
+        header = ()
+        if not full and not projection:
+            header = ("environment  disabled  domain",
+                      "-----------  --------  {}".format("-" * 32))
+        with self.output.collection(self.key_name, header=header) as out:
+            for res, content in items:
+                if full or projection:
+                    out.record(res, content)
+                    continue
+
+                marker = 'x' if content.get('enabled') == False else ''
+                out.record(res, content, line="{1:^11}  {2:^8}  {0}"\
+                           .format(res, content.get('environment_name'),
+                                   marker))
 
     @plac.annotations(
         domain=('Domain to deploy', 'positional', None),
@@ -99,29 +134,35 @@ class InstanceInterface(BaseInterface):
     def enable(self, domain):
         """ Reenable a previously disabled instance """
         self.api.execute_sync_task('put', self.get_url(domain),
-                                   data={'action': 'enable'})
+                                   data=self.actions['enable'])
 
     @plac.annotations(domain=('The instance to disable', 'positional'))
     def disable(self, domain):
         """ Disable an instance, i.e. it stops the vassal but keep data and db
             in place"""
         self.api.execute_sync_task('put', self.get_url(domain),
-                                   data={'action': 'disable'})
+                                   data=self.actions['disable'])
 
     @plac.annotations(domain=('The instance to flush', 'positional'))
     def flush(self, domain):
         """ Flush cache for an instance """
         self.api.execute_sync_task('put', self.get_url(domain),
-                                   data={'action': 'flush_cache'})
+                                   data=self.actions['flush'])
 
     @plac.annotations(domain=('The instance to reload', 'positional'))
     def reload(self, domain):
         """ Reload the vassal for an instance """
         self.api.execute_sync_task('put', self.get_url(domain),
-                                   data={'action': 'reload'})
+                                   data=self.actions['reload'])
+
+    @plac.annotations(**rolling_options)
+    def reload_all(self, wave=None, by_env=False, probe=None,
+                   max_failures=0.0, timeout=None):
+        """ Reload all instances at once, or in waves with -w and/or -e """
+        if wave or by_env:
+            return self.rolling('reload', wave, by_env, probe, max_failures,
+                                timeout)
 
-    def reload_all(self):
-        """ Reload all instances at once"""
         self.api.execute_sync_task('put', self.root_url,
                                    data={'action': 'reload'})
 
@@ -129,10 +170,16 @@ class InstanceInterface(BaseInterface):
     def rewrite(self, domain):
         """ Rewrite instance config (thus reloading the uwsgi vassal) """
         self.api.execute_sync_task('put', self.get_url(domain),
-                                   data={'action': 'rewrite'})
+                                   data=self.actions['rewrite'])
+
+    @plac.annotations(**rolling_options)
+    def rewrite_all(self, wave=None, by_env=False, probe=None,
+                    max_failures=0.0, timeout=None):
+        """ Rewrite all instances at once, or in waves with -w and/or -e """
+        if wave or by_env:
+            return self.rolling('rewrite', wave, by_env, probe, max_failures,
+                                timeout)
 
-    def rewrite_all(self):
-        """ Rewrite all instances at once"""
         self.api.execute_sync_task('put', self.root_url,
                                    data={'action': 'rewrite'})
 
@@ -142,15 +189,13 @@ class InstanceInterface(BaseInterface):
     def force_reload(self, domain):
         """ Kill an instance's vassal sending SIGTERM to the process """
         self.api.execute_sync_task('put', self.get_url(domain),
-                                   data={'action': 'reload',
-                                         'force': 'true'})
+                                   data=self.actions['force_reload'])
 
     @plac.annotations(domain=('The instance to kill', 'positional'))
     def kill(self, domain):
         """ Kill an instance's vassal sending a SIGKILL to the process """
         self.api.execute_sync_task('put', self.get_url(domain),
-                                   data={'action': 'reload',
-                                         'kill': 'true'})
+                                   data=self.actions['kill'])
 
     @plac.annotations(
         domain=('The instance to archive', 'positional'),
@@ -170,9 +215,18 @@ class InstanceInterface(BaseInterface):
         archive=('Archive name', 'option', 'n', str, None, 'NAME')
     )
     def restore(self, domain, archive_file=None, archive=None):
-        """ Restore an instance using a pre-created archive """
+        """ Restore an instance using a pre-created archive or a local
+            archive file, which is uploaded first if the server does not
+            already have it.
+        """
         params = dict(action='restore')
-        # TODO handle archive upload
+        if archive_file:
+            archives = self.main.interface(ArchiveInterface.name)
+            archive = archives.upload(archive_file, archive)
+            if not archive:
+                self.log.error("Cannot upload %s", archive_file)
+                return
+
         if archive:
             params['archive'] = archive
         self.api.execute_sync_task('put', self.get_url(domain), data=params)
@@ -215,19 +269,106 @@ class InstanceInterface(BaseInterface):
     )
     def migrate(self, domain, revision='head'):
         self.api.execute_sync_task('put', self.get_url(domain),
-                                   data={'action': 'migrate',
-                                         'revision': revision})
+                                   data=dict(self.actions['migrate'],
+                                             revision=revision))
 
     @plac.annotations(
         revision=('Schema revision to migrate to', 'option', 'm', str, None,
-                  'REV')
+                  'REV'),
+        concurrency=('Migrate instances from the cli, NUM at a time',
+                     'option', 'c', int, None, 'NUM'),
+        restart=('Forget the progress of a previous run', 'flag', 'r'),
+        timeout=('Give up on tasks running for more than SECONDS', 'option',
+                 't', float, None, 'SECONDS')
     )
-    def migrate_all(self, revision="head"):
-        """ Migrate all instances at once """
+    def migrate_all(self, revision="head", concurrency=None, restart=False,
+                    timeout=None):
+        """ Migrate all instances at once. With -c the cli migrates every
+            instance, environment by environment, keeping a journal of the
+            completed ones: an interrupted run resumes where it stopped.
+        """
+        if concurrency:
+            return self.migrate_each(revision, concurrency, restart, timeout)
+
         self.api.execute_sync_task('put', self.root_url,
                                    data={'action': 'migrate',
                                          'revision': revision})
 
+    def journal_path(self, name):
+        from . completion import cache_dir
+        return os.path.join(cache_dir(), "{}-{}.journal"\
+                            .format(self.main.current_remote, name))
+
+    def read_journal(self, path):
+        """ The domains recorded as done in the journal at path """
+        done = set()
+        try:
+            with open(path) as f:
+                for line in f:
+                    domain, sep, status = line.rstrip("\n").partition("\t")
+                    if status == 'FINISHED':
+                        done.add(domain)
+
+        except IOError:
+            pass
+
+        return done
+
+    def migrate_each(self, revision='head', concurrency=10, restart=False,
+                     timeout=None):
+        """ Migrate instances one by one, grouped by environment so that
+            its virtualenv stays warm, concurrency at a time.
+        """
+        path = self.journal_path("migrate-{}".format(revision))
+        if restart and os.path.exists(path):
+            os.unlink(path)
+        done = self.read_journal(path)
+        if done:
+            self.log.info("Resuming migration, %d instances already at %s",
+                          len(done), revision)
+
+        groups = {}
+        for domain, data in self.iter_list(fields='environment_name'):
+            if domain not in done:
+                groups.setdefault(data.get('environment_name'),
+                                  []).append(domain)
+
+        total = sum(len(domains) for domains in groups.values())
+        data = dict(self.actions['migrate'], revision=revision)
+        results = {}
+        start = time.time()
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(path, 'a') as journal:
+            def on_done(domain, status):
+                journal.write("{}\t{}\n".format(domain, status))
+                journal.flush()
+                results[domain] = status
+                elapsed = time.time() - start
+                rate = len(results) / elapsed
+                eta = (total - len(results)) / rate
+                self.log.info("[%d/%d] %s: %s (%.1f/min, ETA %dm%02ds)",
+                              len(results), total, domain, status,
+                              rate * 60, eta // 60, eta % 60)
+
+            for env in sorted(groups):
+                self.log.info("Migrating %d instances of %s",
+                              len(groups[env]), env)
+                tasks = [(domain, self.get_url(domain), dict(data=data))
+                         for domain in sorted(groups[env])]
+                self.api.execute_tasks('put', tasks, concurrency=concurrency,
+                                       task_timeout=timeout, on_done=on_done)
+
+        failed = [d for d in results if results[d] != 'FINISHED']
+        for domain in sorted(failed):
+            self.log.info(" • {:<40} {}".format(domain, results[domain]))
+        self.log.info("migrate: %d succeeded, %d failed in %.2fs",
+                      len(results) - len(failed), len(failed),
+                      time.time() - start)
+        if not failed:
+            os.unlink(path)
+
     @plac.annotations(
         domain=('Instance domain', 'positional'),
         group=('The group to add to instance', 'positional')
@@ -276,3 +417,160 @@ class InstanceInterface(BaseInterface):
         content = content or {}
         for res in sorted(content):
             self.log.info(" • {}".format(res))
+
+    def select(self, domains=(), pattern=None, **query):
+        """ Resolve a list of domains, a glob on domain names and/or a list
+            query (as in instances_list) to a sorted list of domains.
+        """
+        selected = set(domains)
+        if pattern or query:
+            response, content = self.api.get(self.root_url, quiet=True,
+                                             query_params=query)
+            content = content or {}
+            selected.update(d for d in content
+                            if not pattern or fnmatch.fnmatch(d, pattern))
+
+        return sorted(selected)
+
+    @plac.annotations(
+        action=('Action to run on every instance', 'positional', None, str,
+                sorted(actions)),
+        pattern=('Select instances whose domain matches the glob', 'option',
+                 'g', str, None, 'GLOB'),
+        concurrency=('Max number of tasks running at once', 'option', 'c',
+                     int, None, 'NUM'),
+        revision=('Schema revision to migrate to', 'option', 'm', str, None,
+                  'REV'),
+        timeout=('Give up on tasks running for more than SECONDS', 'option',
+                 't', float, None, 'SECONDS'),
+        domains=('Instances to act on', 'positional')
+    )
+    def bulk(self, action, pattern=None, concurrency=10, revision='head',
+             timeout=None, *domains, **query):
+        """ Run an action on many instances concurrently. Instances are
+            selected by domain, by glob or with a list query using
+            field=value, i.e.
+            instances_bulk reload -g '*.example.com' environment_name=prod
+        """
+        if not domains and not pattern and not query:
+            self.log.error("No instances selected")
+            return
+
+        data = dict(self.actions[action])
+        if action == 'migrate':
+            data['revision'] = revision
+
+        selected = self.select(domains, pattern, **query)
+        self.log.info("Running %s on %d instances", action, len(selected))
+        tasks = [(domain, self.get_url(domain), dict(data=data))
+                 for domain in selected]
+        results = self.api.execute_tasks('put', tasks,
+                                         concurrency=concurrency,
+                                         task_timeout=timeout)
+
+        failed = [d for d in results if results[d] != 'FINISHED']
+        for domain in sorted(results):
+            self.log.info(" • {:<40} {}".format(domain, results[domain]))
+        self.log.info("%s: %d succeeded, %d failed", action,
+                      len(results) - len(failed), len(failed))
+
+    def waves(self, wave=None, by_env=False):
+        """ Split all the instances in waves of wave instances (or wave
+            percent of them when wave ends with %), grouped by environment
+            if by_env. Returns a list of (environment, domains).
+        """
+        groups = {}
+        for domain, data in self.iter_list(fields='environment_name'):
+            env = data.get('environment_name') if by_env else None
+            groups.setdefault(env, []).append(domain)
+
+        waves = []
+        for env in sorted(groups):
+            domains = sorted(groups[env])
+            if not wave:
+                size = len(domains)
+            elif wave.endswith('%'):
+                size = int(math.ceil(len(domains) * float(wave[:-1]) / 100))
+            else:
+                size = int(wave)
+            size = max(size, 1)
+            waves.extend((env, domains[i:i + size])
+                         for i in xrange(0, len(domains), size))
+
+        return waves
+
+    def probe(self, url, timeout=60, interval=1):
+        """ GET url until it answers without a server error, for at most
+            timeout seconds. Returns True if it did.
+        """
+        import requests
+        deadline = time.time() + timeout
+        while True:
+            try:
+                response = requests.get(url, timeout=interval * 5,
+                                        verify=False, allow_redirects=False)
+                if response.status_code < 500:
+                    return True
+                self.log.debug("%s: %s", url, response.status_code)
+
+            except requests.exceptions.RequestException as e:
+                self.log.debug("%s: %s", url, e)
+
+            if time.time() > deadline:
+                return False
+            time.sleep(interval)
+
+    def rolling(self, action, wave=None, by_env=False, probe=None,
+                max_failures=0.0, timeout=None):
+        """ Run action on all the instances, a wave at a time. Tasks of a
+            wave run concurrently; the next wave starts when all of them
+            have finished and, if given, the probe url of every domain
+            answers. Stops when the failures of a wave exceed max_failures.
+        """
+        waves = self.waves(wave, by_env)
+        total = sum(len(domains) for env, domains in waves)
+        self.log.info("Running %s on %d instances in %d waves", action,
+                      total, len(waves))
+        results = {}
+        for num, (env, domains) in enumerate(waves, 1):
+            start = time.time()
+            self.log.info("Wave %d/%d%s: %d instances", num, len(waves),
+                          " ({})".format(env) if env else "", len(domains))
+            tasks = [(domain, self.get_url(domain),
+                      dict(data=self.actions[action]))
+                     for domain in domains]
+            wave_results = self.api.execute_tasks('put', tasks,
+                                                  concurrency=len(tasks),
+                                                  task_timeout=timeout)
+
+            if probe:
+                from multiprocessing.pool import ThreadPool
+                ok = [d for d in domains if wave_results[d] == 'FINISHED']
+                pool = ThreadPool(len(ok) or 1)
+                try:
+                    answers = pool.map(self.probe,
+                                       [probe.format(domain=d) for d in ok])
+
+                finally:
+                    pool.close()
+                    pool.join()
+
+                for domain, answer in zip(ok, answers):
+                    if not answer:
+                        wave_results[domain] = 'UNHEALTHY'
+
+            results.update(wave_results)
+            failed = [d for d in domains if wave_results[d] != 'FINISHED']
+            self.log.info("Wave %d/%d done in %.2fs, %d failed", num,
+                          len(waves), time.time() - start, len(failed))
+            if len(failed) > max_failures * len(domains):
+                self.log.error("Too many failures in wave %d, aborting: %s",
+                               num, ", ".join(failed))
+                break
+
+        failed = [d for d in results if results[d] != 'FINISHED']
+        for domain in sorted(failed):
+            self.log.info(" • {:<40} {}".format(domain, results[domain]))
+        self.log.info("%s: %d succeeded, %d failed, %d not run", action,
+                      len(results) - len(failed), len(failed),
+                      total - len(results))
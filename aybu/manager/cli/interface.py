@@ -23,14 +23,21 @@ import logging
 
 class BaseInterface(object):
 
-    def __init__(self, client, main_interface):
+    # the name of the attribute resources are keyed by, in records
+    key_name = 'name'
+
+    def __init__(self, main_interface):
         self.log = logging.getLogger('aybu.manager.cli.{}'\
                                     .format(self.__class__.__name__))
-        self.api = client
         self.main = main_interface
         if not hasattr(self, 'root_url'):
             self.root_url = '/{}'.format(self.name)
 
+    @property
+    def api(self):
+        # the client is created on first use, and replaced on connect
+        return self.main.api_client
+
     @property
     def interactive(self):
         return self.main._interact_ if hasattr(self.main, '_interact_') \
@@ -45,7 +52,7 @@ class BaseInterface(object):
         """
 
         # first: if we have a get_${command}_completion call it
-        attr = "get_{}_completions"
+        attr = "get_{}_completions".format(command)
         try:
             return getattr(self, attr)(command, parts)
 
@@ -76,11 +83,11 @@ class BaseInterface(object):
             return []
 
         # string startswith themselves, avoid replication
-        res = set(self.get_list(quiet=True, debug=False))
-        if kw in res:
+        index = self.main.completions.get(self)
+        if kw in index:
             return []
 
-        return [w for w in res if w.startswith(kw)]
+        return index.startswith(kw)
 
     def get_url(self, *parts):
         url = self.root_url
@@ -101,38 +108,69 @@ class BaseInterface(object):
             return []
 
         else:
-            return content.keys()
+            return (content or {}).keys()
+
+    @property
+    def output(self):
+        return self.main.output
 
     def print_info(self, content, prompt=''):
         if not content:
             return
-        max_len = max({len(k) for k in content})
-        max_len = 30 if max_len < 30 else max_len
-        format_string = unicode("{}{:<%d}: {}" % (max_len))
-
-        for attr in sorted(content.keys()):
-            key = attr
-            if key.startswith("__"):
-                continue
-            if attr.startswith("_"):
-                key = attr[1:]
-            cont = content[attr]
-            if isinstance(cont, list):
-                cont = ", ".join([str(e) for e in cont])
-            self.log.info(format_string.format(prompt, key, cont))
+        self.output.info(content, prompt=prompt)
+
+    def iter_list(self, page_size=None, fields=None, quiet=True, **query):
+        """ Yield (key, resource) pairs of the collection as they are
+            received. With page_size, resources are fetched page_size at a
+            time using limit and offset; fields restricts the attributes
+            returned for every resource (comma separated).
+        """
+        if fields:
+            query['fields'] = fields
+
+        if not page_size:
+            for item in self.api.iter_items(self.root_url, quiet=quiet,
+                                            query_params=query):
+                yield item
+            return
+
+        offset = 0
+        seen = set()
+        while True:
+            query.update(dict(limit=page_size, offset=offset))
+            count = 0
+            for key, value in self.api.iter_items(self.root_url, quiet=quiet,
+                                                  query_params=query):
+                count = count + 1
+                # a server ignoring limit/offset sends everything each time
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield key, value
+
+            if count < page_size or len(seen) < offset + count:
+                return
+            offset = offset + count
 
     @plac.annotations(
         full=('Get complete output', 'flag', 'f'),
-        verbose=('Be verbose', 'flag', 'v')
+        verbose=('Be verbose', 'flag', 'v'),
+        page_size=('Fetch N resources per request', 'option', 'p', int,
+                   None, 'N'),
+        fields=('Attributes to fetch (comma separated)', 'option', 'a',
+                str, None, 'FIELDS')
     )
-    def list(self, full=False, verbose=False):
-        quiet = not verbose
-        response, content = self.api.get(self.root_url, quiet=quiet)
-        content = content or {}
-        for res in sorted(content):
-            self.log.info(" • {}".format(res))
-            if full:
-                self.print_info(content[res], prompt='   ° ')
+    def list(self, full=False, verbose=False, page_size=None, fields=None):
+        items = self.iter_list(page_size=page_size, fields=fields,
+                               quiet=not verbose)
+        # resources are sorted unless paging, where they are shown as soon
+        # as they are received
+        if not page_size:
+            items = sorted(items)
+
+        with self.output.collection(self.key_name) as out:
+            for res, content in items:
+                out.record(res, content, full=full or fields)
 
     @plac.annotations(
         resource=('The resource to operate on', 'positional')
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+Job = namedtuple('Job', ('uuid', 'remote', 'command', 'target', 'submitted',
+                         'status', 'finished'))
+
+
+class JobTable(object):
+    """ Every task submitted from this host, in a sqlite database, so that
+        tasks that were deferred or not waited for can be found again
+        after the cli exits. Tasks are added as they are submitted and
+        updated when their final status is known. The connection is shared
+        by the threads running commands. Writes are committed at most every
+        commit_interval seconds, so that bulk commands do not commit once
+        per task, and by flush, at the end of every command.
+    """
+    # statuses that do not mean a task is over
+    pending_statuses = ('UNDEFINED', 'DEFERRED', 'QUEUED', 'STARTED',
+                        'RUNNING', 'PENDING', 'TIMEOUT')
+    commit_interval = 0.2
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.lock = threading.Lock()
+        self.committed = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                        "uuid TEXT PRIMARY KEY, remote TEXT, command TEXT, "
+                        "target TEXT, submitted REAL, status TEXT, "
+                        "finished REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_pending "
+                        "ON jobs (remote, finished)")
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+    def flush(self):
+        with self.lock:
+            self.commit()
+
+    def commit(self):
+        """ Commit the pending writes, to be called with the lock held """
+        self.db.commit()
+        self.committed = time.time()
+
+    def write(self, sql, params):
+        with self.lock:
+            self.db.execute(sql, params)
+            if time.time() - self.committed >= self.commit_interval:
+                self.commit()
+
+    def add(self, uuid, remote, command, target, status, submitted=None):
+        self.write("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   (uuid, remote, command, target, submitted or time.time(),
+                    status, self.finished(status)))
+
+    def update(self, uuid, status):
+        self.write("UPDATE jobs SET status = ?, finished = ? WHERE uuid = ?",
+                   (status, self.finished(status), uuid))
+
+    def finished(self, status):
+        """ When a task with status was over, None if it is not """
+        if status in self.pending_statuses:
+            return None
+        return time.time()
+
+    def get(self, uuid):
+        with self.lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE uuid = ?",
+                                  (uuid, )).fetchone()
+        return Job(*row) if row else None
+
+    def pending(self, remote):
+        """ The jobs submitted to remote not known to be over, oldest
+            first
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT * FROM jobs WHERE remote = ? "
+                                   "AND finished IS NULL "
+                                   "ORDER BY submitted", (remote, ))\
+                          .fetchall()
+        return [Job(*row) for row in rows]
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import codecs
+import json
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+DELIMITERS = ' \t\n\r,}'
+
+
+def iter_items(chunks, encoding='utf-8'):
+    """ Incrementally parse a JSON object read from an iterable of chunks
+        of bytes, yielding its (key, value) pairs as soon as each value has
+        been received. An empty input is an empty object.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder(encoding)()
+    chunks = iter(chunks)
+    buf = u''
+    pos = 0
+    expect = '{'
+    key = None
+
+    while True:
+        pos = WHITESPACE.match(buf, pos).end()
+        need_data = pos == len(buf)
+
+        if not need_data:
+            char = buf[pos]
+            if expect == '{':
+                if char != '{':
+                    raise ValueError("Expected an object at {}".format(pos))
+                pos = pos + 1
+                expect = 'key or }'
+
+            elif expect in ('key', 'key or }'):
+                if char == '}' and expect == 'key or }':
+                    pos = pos + 1
+                    expect = 'end'
+
+                elif char == '"':
+                    try:
+                        key, pos = decoder.raw_decode(buf, pos)
+                        expect = ':'
+
+                    except ValueError:
+                        need_data = True
+
+                else:
+                    raise ValueError("Expected a key at {}".format(pos))
+
+            elif expect == ':':
+                if char != ':':
+                    raise ValueError("Expected ':' at {}".format(pos))
+                pos = pos + 1
+                expect = 'value'
+
+            elif expect == 'value':
+                # a number may have been cut by the end of the buffer, the
+                # value is complete only when followed by a delimiter
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    need_data = end == len(buf) or buf[end] not in DELIMITERS
+
+                except ValueError:
+                    need_data = True
+
+                if not need_data:
+                    pos = end
+                    expect = ', or }'
+                    yield key, value
+
+            elif expect == ', or }':
+                if char not in ',}':
+                    raise ValueError("Expected ',' or '}}' at {}".format(pos))
+                pos = pos + 1
+                expect = 'key' if char == ',' else 'end'
+
+            else:
+                raise ValueError("Extra data at {}".format(pos))
+
+        if need_data:
+            try:
+                chunk = next(chunks)
+
+            except StopIteration:
+                if expect == 'end' or (expect == '{' and not buf.strip()):
+                    return
+                raise ValueError("Truncated JSON object")
+
+            buf = buf[pos:] + text.decode(chunk)
+            pos = 0
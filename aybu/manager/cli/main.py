@@ -16,23 +16,25 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import importlib
 import logging
 import os
 import plac
 import sys
-import requests
-
-from . instance import InstanceInterface
-from . task import TaskInterface
-from . environment import EnvironmentInterface
-from . theme import ThemeInterface
-from . group import GroupInterface
-from . user import UserInterface
-from . redirect import RedirectInterface
-from . archive import ArchiveInterface
-from . alias import AliasInterface
-from . client import AybuManagerClient
+import threading
+import time
+
+from . import manifest
+from . client import TaskTimeout
 from . autocomplete import AybuManagerCliReadline
+from . completion import CompletionCache, CompletionFile, cache_dir
+from . output import Output
+from . batch import Batch, BatchFailed, parse_script
+from . fanout import FanOut, RemoteFilter, RemotesFailed
+from . pool import ClientPool
+from . maintainer import Maintainer
+from . metrics import quantiles
+from . profiling import Profiler
 
 
 def string_to_level(level):
@@ -48,20 +50,108 @@ def string_to_level(level):
 
 class AybuManagerCliInterface(object):
 
-    interfaces = (InstanceInterface, TaskInterface, EnvironmentInterface,
-                  ThemeInterface, GroupInterface, UserInterface,
-                  RedirectInterface, ArchiveInterface, AliasInterface)
     interface_instances = {}
-    commands = set(('exit', 'quit', 'help_commands', 'set_log_level',
-                    'connect', 'show_remote'))
+    builtin_commands = set(manifest.builtins)
+    all_commands = builtin_commands | set(manifest.commands())
+    completions = CompletionCache()
+    # shared with the readline input, which shows its state in the prompt
+    maintainer = None
+
+    @property
+    def commands(self):
+        """ The commands plac builds its parser for. When a single command
+            is given on the command line only the commands it can abbreviate
+            are exposed, so that the other interfaces are never loaded.
+        """
+        if self._commands is None:
+            args = getattr(self, '_args_', None)
+            if not args or args[0] in ('help', 'batch'):
+                self._commands = set(self.all_commands)
+            else:
+                self._commands = set(c for c in self.all_commands
+                                     if c.startswith(args[0]))
+        return self._commands
+
+    @commands.setter
+    def commands(self, commands):
+        self._commands = commands
+
+    @property
+    def _args_(self):
+        # -B FILE is a shortcut for the batch command
+        if self.batch_file and not self._argv:
+            return ('batch', self.batch_file)
+        return self._argv
+
+    @_args_.setter
+    def _args_(self, args):
+        self._argv = args
+
+    @property
+    def output(self):
+        """ The writer of command results. Commands run in parallel by
+            batch each have their own, see Batch.run_parallel.
+        """
+        return getattr(self.local, 'output', None) or self._output
+
+    @output.setter
+    def output(self, output):
+        self._output = output
+
+    def __getattr__(self, attr):
+        if attr not in self.all_commands or attr in self.builtin_commands:
+            raise AttributeError(attr)
+
+        name, command = attr.split("_", 1)
+        return getattr(self.interface(name), command)
 
-    def create_commands_for_interface(self, intf_cls):
-        interface = intf_cls(self.api_client, self)
-        self.__class__.interface_instances[intf_cls.name] = interface
-        for command in interface.commands:
-            command_name = "{}_{}".format(intf_cls.name, command)
-            setattr(self, command_name, getattr(interface, command))
-            self.__class__.commands.add(command_name)
+    def interface(self, name):
+        """ Return the interface called name, building it on first use """
+        try:
+            return self.interface_instances[name]
+
+        except KeyError:
+            intf = manifest.interfaces[name]
+            module = importlib.import_module(intf.module,
+                                             __name__.rpartition(".")[0])
+            interface = getattr(module, intf.cls)(self)
+            self.__class__.interface_instances[name] = interface
+            return interface
+
+    @property
+    def api_client(self):
+        """ The client for the current remote, created on first use.
+            Commands run against many remotes each have their own, see
+            FanOut.
+        """
+        client = getattr(self.local, 'api_client', None)
+        if client:
+            return client
+
+        if not self._api_client:
+            try:
+                self.set_api_client(self.pool.get(self.remote_name))
+
+            except:
+                self.log.exception('Error creating API client')
+                raise
+
+        return self._api_client
+
+    def set_api_client(self, api_client):
+        """ Make api_client the current one. The previous client is left
+            in the pool, to be reused when connecting back to its remote.
+        """
+        self._api_client = api_client
+        if self.completions.invalidate not in api_client.on_change:
+            self._api_client.on_change.append(self.completions.invalidate)
+        if self.record_task not in api_client.on_task:
+            self._api_client.on_task.append(self.record_task)
+        self.completions.clear()
+        if self.task_timeout:
+            self._api_client.task_timeout = self.task_timeout
+        self.log.info("Using remote %s: %s", self.remote_name,
+                      self._api_client)
 
     @plac.annotations(
         level=('logging level to set', 'positional', None, string_to_level)
@@ -76,42 +166,91 @@ class AybuManagerCliInterface(object):
 
         except AttributeError:
             self.log = logging.getLogger('aybu')
-            self.log.addHandler(logging.StreamHandler())
+            handler = logging.StreamHandler()
+            handler.addFilter(RemoteFilter(self))
+            self.log.addHandler(handler)
 
         self.loglevel = level
         self.log.setLevel(self.loglevel)
-        if level == logging.DEBUG:
-            requests.defaults.defaults['verbose'] = sys.stderr
+
+    @plac.annotations(
+        format=('output format', 'positional', None, str, Output.formats)
+    )
+    def set_output(self, format):
+        """ Change the output format of list and info commands """
+        self.output.flush()
+        self.output = Output(format)
+
+    @plac.annotations(
+        script=('File with a command per line, - for stdin', 'positional'),
+        keep_going=('Run all the commands even if some fail', 'flag', 'k')
+    )
+    def batch(self, script, keep_going=False):
+        """ Run the commands of script, sharing one connection to the
+            remote. The commands between a "parallel {" and a "}" line
+            are run concurrently.
+        """
+        if script == '-':
+            steps = parse_script(sys.stdin)
+
         else:
-            requests.defaults.defaults['verbose'] = None
+            with open(script) as f:
+                steps = parse_script(f)
+
+        failed = Batch(self, plac.parser_from(self), keep_going).run(steps)
+        if failed:
+            raise BatchFailed("{} commands failed, first at line {}"\
+                              .format(len(failed), failed[0].step.lineno))
 
     @plac.annotations(
         remote=('remote configuration section name', 'positional')
     )
     def connect(self, remote):
-        """ Connect to a new remote """
+        """ Connect to a new remote, leaving -D or -A mode. Clients of
+            recently used remotes are kept open, so switching back to them
+            is immediate.
+        """
         try:
-            api_client = AybuManagerClient.create_from_config(
-                                                        self.configfile,
-                                                        remote=remote,
-                                                        debug=self.verbose)
+            api_client = self.pool.get(remote)
 
         except Exception as e:
             self.log.error('Cannot connect to %s: %s', remote, e)
 
         else:
-            self.api_client = api_client
-            self.log.info("Using remote %s: %s", remote, self.api_client)
-            for intf in self.__class__.interface_instances.values():
-                intf.api = api_client
+            # the remote switched away from was in use until now
+            self.pool.touch(self.remote_name)
             self.remote_name = remote
+            self.remotes = None
+            self.set_api_client(api_client)
+            self.pool.evict(keep=(remote, ))
 
     @plac.annotations(
         configfile=('Path to the config file', 'option', "F"),
         remote=('Remote server to connect to', 'option', "R"),
-        verbose=('Be verbose', 'flag', 'V')
+        verbose=('Be verbose', 'flag', 'V'),
+        task_timeout=('Give up waiting for a task after SECONDS', 'option',
+                      'T', float, None, 'SECONDS'),
+        output=('Output format of list and info commands', 'option', 'O',
+                str, Output.formats, 'FORMAT'),
+        batch_file=('Run the commands in FILE, see the batch command',
+                    'option', 'B', str, None, 'FILE'),
+        metrics_file=('Export the timings to FILE on exit, see the stats '
+                      'command', 'option', 'M', str, None, 'FILE'),
+        profile=('Profile every command, see the profile command', 'flag',
+                 'P'),
+        remotes=('Run every command against all the REMOTES (comma '
+                 'separated) at once', 'option', 'D', str, None, 'REMOTES'),
+        all_remotes=('Run every command against all the remotes in the '
+                     'config file at once', 'flag', 'A'),
+        remotes_timeout=('Give up on remotes that did not complete a '
+                         'command in SECONDS, with -D or -A', 'option', 'W',
+                         float, None, 'SECONDS'),
+        keep_warm=('Keep the connections to the remote open while the '
+                   'shell is idle, see the keep_warm command', 'flag', 'K')
     )
-    def __init__(self, configfile, verbose, remote):
+    def __init__(self, configfile, verbose, remote, task_timeout, output,
+                 batch_file, metrics_file, profile, remotes, all_remotes,
+                 remotes_timeout, keep_warm):
 
         self.__doc__ = "\nUse help to see subcommands"
         self.remote_name = remote or "default"
@@ -120,26 +259,301 @@ class AybuManagerCliInterface(object):
         llevel = logging.INFO if not verbose else logging.DEBUG
         self.set_log_level(llevel)
         self.verbose = verbose
-
-        try:
-            self.api_client = AybuManagerClient.create_from_config(
-                                                    self.configfile,
-                                                    remote=self.remote_name,
-                                                    debug=verbose)
-            self.log.info("Using remote %s: %s", self.remote_name,
-                          self.api_client)
-        except:
-            self.log.exception('Error creating API client')
-            sys.exit()
-
-        for intf in self.interfaces:
-            self.create_commands_for_interface(intf)
+        self.task_timeout = task_timeout
+        self.output = Output(output or 'table')
+        self.local = threading.local()
+        self.batch_file = batch_file
+        self.metrics_file = metrics_file
+        self.profiler = Profiler(self.profile_dir) if profile else None
+        self.pool = ClientPool(self.configfile, self.verbose)
+        self.remotes = remotes.split(",") if remotes else None
+        if all_remotes:
+            self.remotes = self.pool.remotes()
+        self.remotes_timeout = remotes_timeout
+        self.keep_warm_on_start = keep_warm
+        self._argv = None
+        self._api_client = None
+        self._jobs = None
+        self.jobs_lock = threading.Lock()
+        # the number of commands running, in any thread
+        self.busy = 0
+        self.busy_lock = threading.Lock()
+        self._commands = None
 
     def show_remote(self):
         """ Show current remote """
         self.log.info("Connected to %s: %s", self.remote_name, self.api_client)
+        if self.api_client.cache:
+            self.log.info("HTTP cache: %s", ", ".join(
+                "{} {}".format(k, v)
+                for k, v in self.api_client.cache.stats().iteritems()))
+        self.log.info("Open clients: %s", ", ".join(
+            "{} (idle {:.0f}s)".format(remote, idle)
+            for remote, idle in self.pool.stats()))
+        maintainer = self.maintainer
+        if maintainer and maintainer.checked:
+            self.log.info("Connection: %s (checked %.0fs ago)",
+                          maintainer.state,
+                          time.time() - maintainer.checked)
+
+    @plac.annotations(
+        export=('Write the timings to FILE, as json if it ends with .json, '
+                'as a Prometheus textfile otherwise', 'option', 'e', str,
+                None, 'FILE'),
+        reset=('Discard the timings collected so far', 'flag', 'r')
+    )
+    def stats(self, export=None, reset=False):
+        """ Show the count and the latency percentiles of the requests and
+            tasks sent to the current remote
+        """
+        metrics = self.api_client.metrics
+        if export:
+            metrics.export(export)
+            self.log.info("Timings written to %s", export)
+
+        else:
+            header = (u"{:<7} {:<7} {:<40} {:>6} {:>9} {:>9} {:>9}".format(
+                        u"KIND", u"METHOD", u"ROUTE", u"COUNT", u"P50",
+                        u"P95", u"P99"), )
+            with self.output.collection('metric', header) as out:
+                for kind, method, route, data in metrics.summary():
+                    # streamed responses are only timed to the first byte,
+                    # tasks not waited for only until they are accepted
+                    phase = [p for p in ('total', 'ttfb', 'finished',
+                                         'accepted')
+                             if "{}_count".format(p) in data][0]
+                    line = u"{:<7} {:<7} {:<40} {:>6} {:>9} {:>9} {:>9}"\
+                           .format(kind, method, route,
+                                   data.get("{}_count".format(phase), 0),
+                                   *["{:.3f}s".format(
+                                        data["{}_p{}".format(phase, q)])
+                                     for q in quantiles])
+                    out.record(u"{} {} {}".format(kind, method, route),
+                               data, line=line)
+
+        if reset:
+            metrics.reset()
+
+    @property
+    def current_remote(self):
+        """ The remote the command running in this thread is sent to """
+        return getattr(self.local, 'remote', None) or self.remote_name
+
+    @property
+    def jobs(self):
+        """ The table of the submitted tasks, opened on first use """
+        with self.jobs_lock:
+            if not self._jobs:
+                from . jobs import JobTable
+                self._jobs = JobTable(os.path.join(cache_dir(),
+                                                   'jobs.sqlite'))
+            return self._jobs
+
+    def record_task(self, uuid, status, method=None, path=None):
+        """ Keep track of the tasks submitted by commands in the job
+            table, see tasks_wait
+        """
+        import sqlite3
+        try:
+            if method:
+                self.jobs.add(uuid, self.current_remote,
+                              getattr(self.local, 'command', None), path,
+                              status)
+            else:
+                self.jobs.update(uuid, status)
+
+        except sqlite3.Error as e:
+            self.log.warning("Cannot record task %s: %s", uuid, e)
+
+    @property
+    def profile_dir(self):
+        return os.path.join(cache_dir(), 'profiles')
+
+    def command_name(self, arg):
+        """ The command arg is an abbreviation of """
+        if arg in self.commands:
+            return arg
+        matches = [c for c in self.commands if c.startswith(arg)]
+        return matches[0] if len(matches) == 1 else arg
+
+    def tracked(self, consume):
+        """ Wrap the consume method of the parser to keep the name of
+            the command running in each thread, to count the running
+            commands in busy, and to commit the tasks they submitted to
+            the job table. Commands returning an iterator are running
+            until it is exhausted.
+        """
+        def tracked_consume(arglist):
+            if arglist:
+                self.local.command = self.command_name(arglist[0])
+            with self.busy_lock:
+                self.busy = self.busy + 1
+            try:
+                cmd, result = consume(arglist)
+
+            except:
+                self.command_done()
+                raise
+
+            if plac.iterable(result):
+                return cmd, self.iterate_command(result)
+            self.command_done()
+            return cmd, result
+
+        return tracked_consume
+
+    def iterate_command(self, result):
+        try:
+            for value in result:
+                yield value
+
+        finally:
+            self.command_done()
+
+    def command_done(self):
+        with self.busy_lock:
+            self.busy = self.busy - 1
+        if self._jobs:
+            self._jobs.flush()
+
+    def profiled(self, consume):
+        """ Wrap the consume method of the parser, which parses and runs
+            every command, to profile the commands while a profiler is set.
+            The batch command is not profiled itself, so that each one of
+            its commands is.
+        """
+        def profiled_consume(arglist):
+            profiler = self.profiler
+            if not profiler or not arglist or \
+               self.command_name(arglist[0]) in ('batch', 'profile'):
+                return consume(arglist)
+
+            name = self.command_name(arglist[0])
+            cmd, result = profiler.call(name, consume, arglist)
+            if plac.iterable(result):
+                result = profiler.iterate(name, iter(result))
+            return cmd, result
+
+        profiled_consume.profiled = True
+        return profiled_consume
+
+    def remote_client(self, remote):
+        """ The client for remote, when running commands against many
+            remotes
+        """
+        client = self.pool.get(remote)
+        if self.task_timeout:
+            client.task_timeout = self.task_timeout
+        if self.record_task not in client.on_task:
+            client.on_task.append(self.record_task)
+        return client
+
+    def fanned_out(self, consume):
+        """ Wrap the consume method of the parser to run the commands of
+            the interfaces against every remote in self.remotes, see FanOut
+        """
+        def fanned_out_consume(arglist):
+            if not self.remotes or not arglist or \
+               getattr(self.local, 'remote', None):
+                return consume(arglist)
+
+            name = self.command_name(arglist[0])
+            if name not in self.all_commands or name in self.builtin_commands:
+                return consume(arglist)
+
+            failed = FanOut(self, consume, self.remote_client,
+                            self.remotes_timeout).run(self.remotes, arglist)
+            self.pool.evict(keep=[self.remote_name] + self.remotes)
+            if failed:
+                raise RemotesFailed("{} of {} remotes failed: {}".format(
+                                    len(failed), len(self.remotes),
+                                    ", ".join(r.remote for r in failed)))
+            return name, None
+
+        return fanned_out_consume
+
+    @plac.annotations(
+        state=('Turn profiling on or off', 'positional', None, str,
+               ('on', 'off')),
+        cumulative=('Also sum the profiles of all the commands, printing '
+                    'them with profile off or on exit', 'flag', 'c'),
+        top=('Print the N most expensive functions', 'option', 'n', int,
+             None, 'N'),
+        sort=('Sort functions by KEY', 'option', 's', str,
+              Profiler.sort_keys, 'KEY'),
+        directory=('Save the profiles to DIR', 'option', 'd', str, None,
+                   'DIR')
+    )
+    def profile(self, state, cumulative=False, top=20, sort='cumulative',
+                directory=None):
+        """ Profile the following commands with cProfile, saving a .pstats
+            file for each one. Use "profile on -c" as the first line of a
+            batch script to profile it as a whole.
+        """
+        if self.profiler:
+            self.profiler.close()
+            self.profiler = None
+
+        if state == 'on':
+            self.profiler = Profiler(directory or self.profile_dir, top,
+                                     sort, cumulative)
+            self.log.info("Saving profiles to %s", self.profiler.directory)
+
+    @plac.annotations(
+        state=('Turn the maintainer thread on or off', 'positional', None,
+               str, ('on', 'off')),
+        interval=('Keep the HTTP connections open with a request every '
+                  'SECONDS of inactivity', 'option', 'i', float, None,
+                  'SECONDS')
+    )
+    def keep_warm(self, state, interval=None):
+        """ Check the connections to the current remote in background,
+            keeping them open and reconnecting the subscription to task
+            messages when it drops. Their state is shown in the prompt.
+        """
+        if self.maintainer:
+            self.maintainer.stop()
+            self.__class__.maintainer = None
+
+        if state == 'on':
+            self.__class__.maintainer = Maintainer(self, interval)
+            self.maintainer.start()
+
+    def completion_refresh(self):
+        """ Refresh the on-disk index used by shell completion """
+        index = CompletionFile(self.current_remote).load()
+        index.commands = self.all_commands
+        for name, intf in manifest.interfaces.iteritems():
+            if 'list' not in intf.commands:
+                continue
+
+            response, content = self.api_client.get(
+                                    self.interface(name).root_url,
+                                    quiet=True, headers=index.validators(name))
+            if response is None:
+                self.log.error("Cannot refresh %s completions", name)
+
+            elif response.status_code == 304:
+                self.log.debug("%s completions are up to date", name)
+
+            elif response:
+                index.update(name, (content or {}).keys(),
+                             response.headers.get('etag'),
+                             response.headers.get('last-modified'))
+        index.save()
 
     def __enter__(self):
+        parser = plac.parser_from(self)
+        if not hasattr(parser.consume, 'profiled'):
+            parser.consume = self.fanned_out(self.profiled(
+                                    self.tracked(parser.consume)))
+        if self._interact_:
+            # create the client here rather than in the warm up thread
+            self.api_client
+            self.completions.warm([self.interface(name)
+                                   for name in manifest.interfaces])
+            if self.keep_warm_on_start:
+                self.keep_warm('on')
         return self
 
     def __exit__(self, etype, exc, tb):
@@ -147,6 +561,16 @@ class AybuManagerCliInterface(object):
         if etype in (None, GeneratorExit):  # success
             if self._interact_:
                 self.log.info("exiting...")
+        self.output.flush()
+        if self.maintainer:
+            self.keep_warm('off')
+        if self.profiler:
+            self.profiler.close()
+        if self._api_client and self.metrics_file:
+            self._api_client.metrics.export(self.metrics_file)
+        self.pool.close()
+        if self._jobs:
+            self._jobs.close()
 
     def exit(self):
         raise plac.Interpreter.Exit
@@ -155,11 +579,9 @@ class AybuManagerCliInterface(object):
         self.exit()
 
     def help_commands(self):
-        self.log.info(" ".join([c for c in self.commands if c not in ("help",
-                                                              "help_commands",
-                                                              "exit",
-                                                              ".last_tb",
-                                                              "quit")]))
+        self.log.info(" ".join([c for c in self.all_commands
+                                if c not in ("help", "help_commands", "exit",
+                                             ".last_tb", "quit")]))
 
 
 def main():
@@ -171,3 +593,15 @@ def main():
                               stdin=completer, verbose=True, prompt='aybu> ')
     except KeyboardInterrupt:
         print "interrupted"
+
+    except TaskTimeout as e:
+        print "timeout: {}".format(e)
+        sys.exit(2)
+
+    except BatchFailed as e:
+        print "batch failed: {}".format(e)
+        sys.exit(1)
+
+    except RemotesFailed as e:
+        print "{}".format(e)
+        sys.exit(1)
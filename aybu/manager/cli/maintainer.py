@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Maintainer(object):
+    """ A daemon thread keeping the connections to the current remote of
+        main ready while the shell waits for input, doing nothing while
+        a command is running (see main.busy). Every tick it reads
+        the connection events of the subscription, creating it if needed,
+        and sends a HEAD request once the HTTP session has been idle for
+        interval seconds (half the keepalive_timeout of the client by
+        default), so that pooled connections are neither dropped by the
+        server nor recycled by the client.
+        A subscription that stays disconnected for reconnect_after
+        seconds gets a new socket. The outcome is summed up in state:
+            up:       the remote answers and task messages are received
+            degraded: the remote answers, task messages are not received
+                      (task status is polled over HTTP)
+            down:     the remote cannot be reached
+        or None before the first check.
+    """
+    log = log
+
+    def __init__(self, main, interval=None, tick=1, retry_interval=5,
+                 reconnect_after=10):
+        self.main = main
+        self.interval = interval
+        self.tick = tick
+        self.retry_interval = retry_interval
+        self.reconnect_after = reconnect_after
+        self.client = None
+        self.http = None
+        self.events = None
+        self.checked = None
+        self.pinged = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @property
+    def state(self):
+        if self.http is None:
+            return None
+        if not self.http:
+            return 'down'
+        if self.events is False:
+            return 'degraded'
+        return 'up'
+
+    def describe(self):
+        """ The remote and its state, as shown in the prompt """
+        return "{} {}".format(self.main.remote_name, self.state)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='maintainer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(self.tick)
+            self.thread = None
+
+    def run(self):
+        while not self.stopped.wait(self.tick):
+            try:
+                self.check()
+
+            except Exception:
+                # nothing is printed while the user is typing
+                self.log.debug("Connection check failed", exc_info=True)
+
+    def check(self):
+        # the current client is never created here, but when it changes
+        client = self.main._api_client
+        if client is not self.client:
+            self.client = client
+            self.http = self.events = None
+        if not client or self.main.busy:
+            return
+
+        interval = self.interval or (client.keepalive_timeout / 2.0
+                                     if client.keepalive_timeout else 30)
+        if self.http is False:
+            interval = min(interval, self.retry_interval)
+
+        # pings of an unreachable remote do not use the session
+        last_used = max(client._session_last_used or 0, self.pinged)
+        if self.http is None or time.time() - last_used >= interval:
+            self.pinged = time.time()
+            http = client.ping()
+            if http != self.http:
+                self.log.debug("%s is %s", self.main.remote_name,
+                               "reachable" if http else "unreachable")
+            self.http = http
+
+        subscription = client.subscription
+        connected = subscription.check()
+        if connected is not None:
+            self.events = connected
+
+        if connected is False and \
+           time.time() - subscription.changed >= self.reconnect_after:
+            subscription.reconnect()
+
+        self.checked = time.time()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# The interfaces of the cli and their commands. This module is read to
+# list commands without loading any interface: keep it free of heavy
+# imports.
+from collections import namedtuple, OrderedDict
+
+Interface = namedtuple('Interface', ('module', 'cls', 'commands'))
+
+interfaces = OrderedDict((
+    ('instances', Interface('.instance', 'InstanceInterface',
+        ('list', 'deploy', 'delete', 'enable', 'disable', 'flush',
+         'switch_env', 'reload', 'reload_all', 'rewrite', 'rewrite_all',
+         'archive', 'restore', 'info', 'migrate', 'kill', 'force_reload',
+         'change_domain', 'groups_add', 'groups_remove', 'groups_empty',
+         'groups_set', 'allowed_users', 'migrate_all', 'bulk'))),
+    ('tasks', Interface('.task', 'TaskInterface',
+        ('list', 'logs', 'delete', 'flush', 'info', 'flush_logs',
+         'follow', 'wait'))),
+    ('envs', Interface('.environment', 'EnvironmentInterface',
+        ('list', 'create', 'delete', 'rename', 'info', 'rewrite'))),
+    ('themes', Interface('.theme', 'ThemeInterface',
+        ('list', 'create', 'update', 'info', 'delete'))),
+    ('groups', Interface('.group', 'GroupInterface',
+        ('list', 'create', 'update', 'info', 'delete'))),
+    ('users', Interface('.user', 'UserInterface',
+        ('list', 'create', 'update', 'info', 'delete', 'check_login',
+         'allowed_instances'))),
+    ('redirects', Interface('.redirect', 'RedirectInterface',
+        ('list', 'create', 'edit', 'info', 'delete'))),
+    ('archives', Interface('.archive', 'ArchiveInterface',
+        ('list', 'create', 'rename', 'download', 'upload', 'delete'))),
+    ('aliases', Interface('.alias', 'AliasInterface',
+        ('list', 'create', 'edit', 'info', 'delete')))
+))
+
+# the commands of the cli itself
+builtins = ('exit', 'quit', 'help_commands', 'set_log_level', 'connect',
+            'show_remote', 'completion_refresh', 'set_output', 'batch',
+            'stats', 'profile', 'keep_warm')
+
+
+def commands():
+    """ All the interface commands, as used on the command line """
+    return ["{}_{}".format(name, command)
+            for name, intf in interfaces.iteritems()
+            for command in intf.commands]
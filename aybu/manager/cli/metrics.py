@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# the name of the placeholder for the resources of each collection
+placeholders = dict(instances='domain', aliases='domain', tasks='uuid',
+                    users='email', redirects='source')
+quantiles = (50, 95, 99)
+
+
+def route_template(path):
+    """ The route of path, with resource names replaced by placeholders,
+        i.e. /instances/example.com/groups/admin is
+        /instances/{domain}/groups/{name}
+    """
+    parts = path.split("?")[0].strip("/").split("/")
+    for i in xrange(1, len(parts), 2):
+        parts[i] = "{{{}}}".format(placeholders.get(parts[i - 1], 'name'))
+    return "/{}".format("/".join(parts))
+
+
+def percentile(samples, q):
+    """ The q-th percentile of the sorted list samples (nearest rank) """
+    if not samples:
+        return None
+    rank = int(math.ceil(q / 100.0 * len(samples)))
+    return samples[max(rank, 1) - 1]
+
+
+class Metrics(object):
+    """ Timings of the requests and tasks of a client, in seconds.
+        Request phases are ttfb (from sending the request to receiving the
+        response headers, connection included), transfer (reading the
+        body), decode (parsing json) and total. Task phases are accepted
+        (until the response to the submission) and finished (until the
+        finished message, or the final status).
+        Samples are keyed by (kind, method, route); the last max_samples of
+        every phase are kept.
+    """
+
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self.samples = OrderedDict()
+        self.counts = collections.Counter()
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def observe(self, kind, method, path, phase, seconds):
+        key = (kind, method.upper(), route_template(path))
+        with self.lock:
+            phases = self.samples.setdefault(key, OrderedDict())
+            if phase not in phases:
+                phases[phase] = collections.deque(maxlen=self.max_samples)
+            phases[phase].append(seconds)
+
+    def count(self, kind, method, path, status):
+        key = (kind, method.upper(), route_template(path))
+        with self.lock:
+            self.counts[key + (str(status), )] += 1
+
+    def request(self, method, path, status, **phases):
+        self.count('request', method, path, status)
+        for phase, seconds in phases.iteritems():
+            if seconds is not None:
+                self.observe('request', method, path, phase, seconds)
+
+    def task_submitted(self, uuid, method, path, start):
+        with self.lock:
+            self.tasks[uuid] = (method, path, start)
+
+    def task_accepted(self, uuid):
+        method, path, start = self.tasks.get(uuid, (None, None, None))
+        if method:
+            self.observe('task', method, path, 'accepted',
+                         time.time() - start)
+
+    def task_finished(self, uuid, status):
+        with self.lock:
+            method, path, start = self.tasks.pop(uuid, (None, None, None))
+        if not method:
+            return
+        self.count('task', method, path, status)
+        self.observe('task', method, path, 'finished', time.time() - start)
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.counts.clear()
+            self.started = time.time()
+
+    def summary(self):
+        """ A list of (kind, method, route, data), where data holds the
+            count of every status and the count, sum and quantiles of every
+            phase.
+        """
+        with self.lock:
+            samples = [(k, OrderedDict((p, sorted(s))
+                                       for p, s in v.iteritems()))
+                       for k, v in self.samples.iteritems()]
+            counts = dict(self.counts)
+
+        res = []
+        for key, phases in sorted(samples):
+            data = OrderedDict()
+            for count_key, num in sorted(counts.iteritems()):
+                if count_key[:3] == key:
+                    data["status_{}".format(count_key[3])] = num
+            for phase, values in phases.iteritems():
+                data["{}_count".format(phase)] = len(values)
+                data["{}_sum".format(phase)] = sum(values)
+                for q in quantiles:
+                    data["{}_p{}".format(phase, q)] = percentile(values, q)
+            res.append(key + (data, ))
+        return res
+
+    def to_json(self):
+        return json.dumps(dict(started=self.started, now=time.time(),
+                               metrics=[dict(kind=kind, method=method,
+                                             route=route, **data)
+                                        for kind, method, route, data
+                                        in self.summary()]),
+                          indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix='aybu_manager_cli'):
+        """ The metrics in the Prometheus text exposition format, as a
+            summary per kind, labelled by method, route and phase.
+        """
+        # the samples of a family must follow its TYPE line, all together
+        families = OrderedDict()
+        for kind, method, route, data in self.summary():
+            name = "{}_{}_seconds".format(prefix, kind)
+            total = "{}_{}s_total".format(prefix, kind)
+            if name not in families:
+                families[name] = ["# TYPE {} summary".format(name)]
+                families[total] = ["# TYPE {} counter".format(total)]
+
+            labels = 'method="{}",route="{}"'.format(method, route)
+            for key, value in data.iteritems():
+                if key.startswith('status_'):
+                    families[total].append('{}{{{},status="{}"}} {}'.format(
+                                           total, labels, key[7:], value))
+                    continue
+
+                phase, sep, stat = key.rpartition("_")
+                if stat.startswith("p"):
+                    families[name].append(
+                            '{}{{{},phase="{}",quantile="{}"}} {:.6f}'\
+                            .format(name, labels, phase,
+                                    int(stat[1:]) / 100.0, value))
+                else:
+                    families[name].append('{}_{}{{{},phase="{}"}} {}'.format(
+                                          name, stat, labels, phase, value))
+        return "".join("\n".join(lines) + "\n"
+                       for lines in families.itervalues())
+
+    def export(self, path):
+        """ Write the metrics to path, as json if it ends with .json and as
+            a Prometheus textfile otherwise. The file is replaced
+            atomically, as the node exporter may be reading it.
+        """
+        text = self.to_json() if path.endswith(".json") \
+               else self.to_prometheus()
+        tmp = "{}.{}".format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.rename(tmp, path)
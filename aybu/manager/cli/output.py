@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import sys
+import time
+from collections import OrderedDict
+
+
+def to_text(value):
+    """ A single line representation of value, for table and tsv output """
+    if value is None:
+        return u''
+    if isinstance(value, (list, tuple)):
+        return u", ".join(to_text(v) for v in value)
+    if isinstance(value, dict):
+        return json.dumps(value, sort_keys=True, ensure_ascii=False)
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+
+class Output(object):
+    """ The writer every command prints its results with.
+        Text is buffered and written to stream when the buffer is full,
+        when flush_interval seconds passed since the last write, and at the
+        end of every command, instead of going through logging line by
+        line.
+        Formats are:
+            table: the human readable listing
+            json:  one document per command
+            jsonl: one json record per line, written as soon as possible
+            tsv:   a header line then tab separated values
+    """
+    formats = ('table', 'json', 'jsonl', 'tsv')
+
+    def __init__(self, format='table', stream=None, buffer_size=65536,
+                 flush_interval=0.2):
+        if format not in self.formats:
+            raise ValueError("Unknown output format {}".format(format))
+        self.format = format
+        self.stream = stream or sys.stdout
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.size = 0
+        self.flushed = time.time()
+        # the last header line written by a tsv collection
+        self.header = None
+
+    @property
+    def machine(self):
+        """ True unless the output is meant to be read by humans """
+        return self.format != 'table'
+
+    def write(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self.buffer.append(text)
+        self.size = self.size + len(text)
+        if self.size >= self.buffer_size or \
+           (self.flush_interval is not None and
+            time.time() - self.flushed >= self.flush_interval):
+            self.flush()
+
+    def writeline(self, text=u''):
+        self.write(text)
+        self.write('\n')
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write(''.join(self.buffer))
+            self.buffer = []
+            self.size = 0
+        self.stream.flush()
+        self.flushed = time.time()
+
+    def info_lines(self, content, prompt=u''):
+        """ The "key: value" lines of the table output of content """
+        if not content:
+            return
+        max_len = max(max(len(k) for k in content), 30)
+        format_string = u"{}{:<%d}: {}" % (max_len)
+        if isinstance(prompt, str):
+            prompt = prompt.decode('utf-8')
+
+        for attr in sorted(content):
+            key = attr
+            if key.startswith("__"):
+                continue
+            if attr.startswith("_"):
+                key = attr[1:]
+            yield format_string.format(prompt, key, to_text(content[attr]))
+
+    def info(self, content, prompt=u''):
+        """ Write a single resource """
+        if self.format == 'table':
+            for line in self.info_lines(content, prompt):
+                self.writeline(line)
+
+        elif self.format == 'tsv':
+            for key in sorted(content or {}):
+                self.writeline(u"{}\t{}".format(
+                        self.escape(key), self.escape(content[key])))
+
+        elif content is not None:
+            self.writeline(json.dumps(content, sort_keys=True,
+                                      ensure_ascii=False))
+        self.flush()
+
+    def escape(self, value):
+        text = to_text(value)
+        return text.replace(u'\\', u'\\\\').replace(u'\t', u'\\t')\
+                   .replace(u'\n', u'\\n')
+
+    def collection(self, key_name, header=()):
+        return Collection(self, key_name, header)
+
+
+class Collection(object):
+    """ A listing of resources, written one record at a time. To be used as
+        a context manager, so that json documents are always closed:
+
+            with output.collection('domain') as out:
+                out.record('example.com', data)
+    """
+
+    def __init__(self, output, key_name, header=()):
+        self.output = output
+        self.key_name = key_name
+        self.header = header
+        self.columns = None
+        self.count = 0
+
+    def __enter__(self):
+        if self.output.format == 'json':
+            self.output.write('{')
+        return self
+
+    def __exit__(self, etype, exc, tb):
+        if self.output.format == 'json':
+            self.output.writeline('\n}' if self.count else '}')
+        self.output.flush()
+
+    def record(self, key, data=None, line=None, full=True):
+        """ Write the resource key. In table format line is written when
+            given, else the key followed by data if full is set. The other
+            formats always write key and data.
+        """
+        output = self.output
+        data = data or {}
+        if output.format == 'table':
+            if not self.count:
+                for text in self.header:
+                    output.writeline(text)
+            if line is not None:
+                output.writeline(line)
+            else:
+                output.writeline(u" • {}".format(to_text(key)))
+                if full:
+                    for text in output.info_lines(data, prompt=u'   ° '):
+                        output.writeline(text)
+
+        elif output.format == 'json':
+            output.write(u'{}\n{}: {}'.format(
+                        ',' if self.count else '',
+                        json.dumps(key, ensure_ascii=False),
+                        json.dumps(data, sort_keys=True, ensure_ascii=False)))
+
+        elif output.format == 'jsonl':
+            record = OrderedDict([(self.key_name, key)])
+            record.update(sorted(data.items()))
+            output.writeline(json.dumps(record, ensure_ascii=False))
+
+        else:
+            if self.columns is None:
+                # columns are fixed by the first record
+                self.columns = sorted(k for k in data if k != self.key_name)
+                output.header = u"\t".join([self.key_name] + self.columns)\
+                                  .encode('utf-8')
+                output.writeline(output.header)
+            output.writeline(u"\t".join(
+                    [output.escape(key)] +
+                    [output.escape(data.get(c)) for c in self.columns]))
+
+        self.count = self.count + 1
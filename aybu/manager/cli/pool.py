@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from . client import AybuManagerClient
+
+log = logging.getLogger(__name__)
+
+
+class ClientPool(object):
+    """ The clients of the remotes used in this session, keyed by remote
+        name, so that switching back to a remote reuses its HTTP session
+        and its subscription. All the clients share the process-wide zmq
+        context. The config file is parsed again only when it changes.
+        evict closes the least recently used clients when there are more
+        than max_size of them, and those unused for idle_timeout seconds.
+    """
+    log = log
+
+    def __init__(self, configfile, debug=False, max_size=4,
+                 idle_timeout=900):
+        self.configfile = configfile
+        self.debug = debug
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        # remote: (client, last used), least recently used first
+        self.clients = OrderedDict()
+        self.lock = threading.RLock()
+        self._config = None
+        self._config_mtime = None
+
+    def __contains__(self, remote):
+        return remote in self.clients
+
+    @property
+    def config(self):
+        try:
+            mtime = os.path.getmtime(self.configfile)
+
+        except OSError:
+            mtime = None
+
+        if self._config is None or mtime != self._config_mtime:
+            self._config = AybuManagerClient.read_config(self.configfile)
+            self._config_mtime = mtime
+        return self._config
+
+    def remotes(self):
+        """ The names of the remotes in the config file """
+        return self.config.sections()
+
+    def get(self, remote):
+        """ The client of remote, created if not in the pool """
+        with self.lock:
+            client, last_used = self.clients.pop(remote, (None, None))
+            if not client:
+                client = AybuManagerClient.create_from_config(
+                                self.configfile, debug=self.debug,
+                                remote=remote, config=self.config)
+            self.clients[remote] = (client, time.time())
+            return client
+
+    def touch(self, remote):
+        """ Record that the client of remote has just been used """
+        with self.lock:
+            if remote in self.clients:
+                self.clients[remote] = (self.clients.pop(remote)[0],
+                                        time.time())
+
+    def last_used(self, remote):
+        """ When the client of remote was last used, through the pool or
+            by a request, as the current client is used without the pool
+        """
+        client, last_used = self.clients[remote]
+        return max(last_used, client._session_last_used or 0)
+
+    def discard(self, remote):
+        with self.lock:
+            client, last_used = self.clients.pop(remote, (None, None))
+        if client:
+            self.log.debug("Closing client of %s", remote)
+            client.close()
+
+    def evict(self, keep=()):
+        """ Close idle clients and the least recently used ones beyond
+            max_size, but those of the remotes in keep
+        """
+        now = time.time()
+        with self.lock:
+            candidates = [r for r in self.clients if r not in keep]
+            excess = max(len(self.clients) - self.max_size, 0)
+            evicted = candidates[:excess]
+            evicted.extend(r for r in candidates[excess:]
+                           if now - self.last_used(r) > self.idle_timeout)
+        for remote in evicted:
+            self.discard(remote)
+
+    def stats(self):
+        """ (remote, seconds since last use) of the pooled clients, most
+            recently used first
+        """
+        now = time.time()
+        with self.lock:
+            return [(remote, now - self.last_used(remote))
+                    for remote in reversed(self.clients)]
+
+    def close(self):
+        """ Close every client, then the zmq context they share """
+        with self.lock:
+            remotes = list(self.clients)
+        for remote in remotes:
+            self.discard(remote)
+        # term waits for every socket to be closed, which never happens
+        # if a command is still running in another thread (i.e. a remote
+        # that timed out)
+        if 'zmq' in sys.modules and threading.active_count() == 1:
+            sys.modules['zmq'].Context.instance().term()
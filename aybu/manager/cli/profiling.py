@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import cProfile
+import itertools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Profiler(object):
+    """ Runs commands under cProfile, saving the stats of each one to
+        directory as <time>-<n>-<command>.pstats and printing the top
+        functions. With cumulative set, the stats of all the commands are
+        also summed, then saved and printed by close.
+        cProfile measures wall clock time, so time spent waiting on HTTP
+        responses and on the subscription socket shows up in the stats.
+    """
+    log = log
+    sort_keys = ('cumulative', 'time', 'calls')
+
+    def __init__(self, directory, top=20, sort='cumulative',
+                 cumulative=False, stream=None):
+        if sort not in self.sort_keys:
+            raise ValueError("Cannot sort profiles by {}".format(sort))
+        self.directory = directory
+        self.top = top
+        self.sort = sort
+        self.cumulative = cumulative
+        self.stream = stream or sys.stderr
+        self.session = time.strftime('%Y%m%d-%H%M%S')
+        self.counter = itertools.count(1)
+        self.total = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @property
+    def active(self):
+        """ True while a command is being profiled in this thread, as
+            profilers cannot be nested
+        """
+        return getattr(self.local, 'active', False)
+
+    def call(self, name, func, *args, **kwargs):
+        """ Call func, profiling it and saving its stats as name """
+        if self.active:
+            return func(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        self.local.active = True
+        try:
+            return profile.runcall(func, *args, **kwargs)
+
+        finally:
+            self.local.active = False
+            self.save(name, profile)
+
+    def iterate(self, name, iterator):
+        """ Profile the consumption of a command returning an iterator """
+        profile = cProfile.Profile()
+        try:
+            while True:
+                self.local.active = True
+                try:
+                    value = profile.runcall(next, iterator)
+
+                except StopIteration:
+                    return
+
+                finally:
+                    self.local.active = False
+                yield value
+
+        finally:
+            self.save(name, profile)
+
+    def save(self, name, profile):
+        with self.lock:
+            number = next(self.counter)
+        path = os.path.join(self.directory, "{}-{:03d}-{}.pstats"\
+                                            .format(self.session, number,
+                                                    name.replace("/", "_")))
+        profile.create_stats()
+        if not profile.stats:
+            return
+
+        profile.dump_stats(path)
+        if self.cumulative:
+            with self.lock:
+                if self.total is None:
+                    self.total = pstats.Stats(profile, stream=self.stream)
+                else:
+                    self.total.add(profile)
+            self.log.debug("Profile of %s saved to %s", name, path)
+            return
+
+        self.log.info("Profile of %s saved to %s", name, path)
+        self.print_stats(pstats.Stats(profile, stream=self.stream))
+
+    def print_stats(self, stats):
+        stats.sort_stats(self.sort).print_stats(self.top)
+        self.stream.flush()
+
+    def close(self):
+        """ Save and print the cumulative stats, if any """
+        with self.lock:
+            total = self.total
+            self.total = None
+        if total is None:
+            return
+
+        path = os.path.join(self.directory,
+                            "{}-total.pstats".format(self.session))
+        total.dump_stats(path)
+        self.log.info("Cumulative profile saved to %s", path)
+        self.print_stats(total)
@@ -22,8 +22,8 @@ from . interface import BaseInterface
 
 class RedirectInterface(BaseInterface):
 
-    commands = ['list', 'create', 'edit', 'info', 'delete']
     name = 'redirects'
+    key_name = 'source'
 
     @plac.annotations(
         source=('Source domain to redirect', 'positional', None, str, None,
@@ -79,11 +79,11 @@ class RedirectInterface(BaseInterface):
         response, content = self.api.get(self.root_url, quiet=quiet)
         content = content or {}
 
-        if not full:
-            for source, data in content.iteritems():
-                print " • {source} => {destination}{target_path} [{http_code}]"\
-                        .format(**data)
-        else:
-            for source, data in content.iteritems():
-                print " • {}:".format(source)
-                self.print_info(data, prompt='   ° ')
+        with self.output.collection(self.key_name) as out:
+            for source, data in sorted(content.iteritems()):
+                if full:
+                    out.record(source, data)
+                    continue
+
+                out.record(source, data, line=" • {source} => {destination}"
+                           "{target_path} [{http_code}]".format(**data))
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import logging
+import threading
+import time
+import zmq
+
+log = logging.getLogger(__name__)
+
+
+def split_uuid(uuid):
+    """ Split a task uuid, made as "{user}..{host}.{pid}-{counter}" with the
+        dots of user standing for "@" and ".", in (user, host, pid).
+        Parts that cannot be parsed are None.
+    """
+    user, sep, rest = uuid.partition("..")
+    if not sep:
+        return None, None, None
+    host, sep, pid = rest.rpartition(".")
+    if not sep:
+        return user, rest, None
+    return user, host, pid.partition("-")[0]
+
+
+class Subscription(object):
+    """ The SUB socket tasks messages are read from.
+        Tasks whose uuid starts with prefix (the ones created by this
+        process) are all covered by a single subscription to prefix; other
+        tasks get their own subscription, removed when they are forgotten.
+        Subscriptions are tracked with a refcount, so following the same
+        task twice is safe.
+        Tasks can be waited for from several threads: one thread at a time
+        reads the socket, queueing the messages of the tasks waited by the
+        others in their mailboxes.
+    """
+    log = log
+    tcp_keepalive_idle = 30
+    tcp_keepalive_interval = 10
+
+    def __init__(self, context, address, prefix, settle=0.1,
+                 ready_timeout=2, poll_interval=0.1):
+        self.context = context
+        self.address = address
+        self.prefix = prefix
+        self.settle = settle
+        self.ready_timeout = ready_timeout
+        self.poll_interval = poll_interval
+        self.topics = {}
+        self.active = set()
+        self.mailboxes = {}
+        self.lock = threading.Condition()
+        self.reading = False
+        self.connected = False
+        self.ready = False
+        # when the connection state and the topics last changed
+        self.changed = time.time()
+        self.subscribed = time.time()
+        self.open()
+
+    def open(self):
+        self.socket = self.context.socket(zmq.SUB)
+        # let the kernel notice publishers that went away without closing
+        # the connection, so that they show up as disconnections
+        if hasattr(zmq, 'TCP_KEEPALIVE'):
+            self.socket.setsockopt(zmq.TCP_KEEPALIVE, 1)
+            self.socket.setsockopt(zmq.TCP_KEEPALIVE_IDLE,
+                                   self.tcp_keepalive_idle)
+            self.socket.setsockopt(zmq.TCP_KEEPALIVE_INTVL,
+                                   self.tcp_keepalive_interval)
+        self.monitor = None
+        if hasattr(self.socket, 'get_monitor_socket'):
+            self.monitor = self.socket.get_monitor_socket(
+                                zmq.EVENT_CONNECTED | zmq.EVENT_DISCONNECTED)
+        self.socket.connect(self.address)
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+        self.connected = False
+        self.ready = False
+        self.changed = time.time()
+
+    def socket_lock(self):
+        """ Acquire the lock, waiting for the socket to be released by
+            the thread reading it.
+        """
+        self.lock.acquire()
+        while self.reading:
+            self.lock.wait(self.poll_interval)
+
+    def subscribe(self, topic):
+        if topic not in self.topics:
+            self.log.debug("Subscribing to %s", topic)
+            self.socket.setsockopt(zmq.SUBSCRIBE, topic)
+            self.topics[topic] = 0
+            self.ready = False
+            self.subscribed = time.time()
+        self.topics[topic] = self.topics[topic] + 1
+
+    def unsubscribe(self, topic):
+        if topic not in self.topics:
+            return
+
+        self.topics[topic] = self.topics[topic] - 1
+        if not self.topics[topic]:
+            self.log.debug("Unsubscribing from %s", topic)
+            self.socket.setsockopt(zmq.UNSUBSCRIBE, topic)
+            del self.topics[topic]
+
+    def topic_for(self, uuid):
+        if uuid.startswith(self.prefix):
+            return self.prefix
+        # the trailing dot keeps "x-1" from matching "x-10"
+        return "{}.".format(uuid)
+
+    def follow(self, uuid):
+        """ Start receiving messages for task uuid """
+        self.socket_lock()
+        try:
+            if uuid in self.active:
+                return
+            self.active.add(uuid)
+            self.mailboxes[uuid] = collections.deque()
+            topic = self.topic_for(uuid)
+            # the process prefix subscription is kept for the whole session
+            if topic != self.prefix or topic not in self.topics:
+                self.subscribe(topic)
+
+        finally:
+            self.lock.release()
+
+    def forget(self, uuid):
+        """ Stop receiving messages for task uuid """
+        self.socket_lock()
+        try:
+            if uuid not in self.active:
+                return
+            self.active.discard(uuid)
+            del self.mailboxes[uuid]
+            topic = self.topic_for(uuid)
+            if topic != self.prefix:
+                self.unsubscribe(topic)
+
+        finally:
+            self.lock.release()
+
+    def wait_ready(self):
+        """ Readiness barrier, to be called before submitting tasks.
+            A subscription only takes effect once the publisher has
+            received it, and messages published before are lost (the
+            "slow joiner" problem). Wait for the connection to be
+            established, then give the subscriptions time to reach the
+            publisher. Returns False if the connection could not be
+            confirmed, meaning early messages may have been missed.
+        """
+        self.socket_lock()
+        try:
+            return self._wait_ready()
+
+        finally:
+            self.lock.release()
+
+    def _wait_ready(self):
+        if self.monitor:
+            self.events()
+        if self.ready:
+            return True
+
+        if self.monitor:
+            deadline = time.time() + self.ready_timeout
+            while not self.connected and time.time() < deadline:
+                self.events(deadline - time.time())
+
+            if not self.connected:
+                self.log.debug("Cannot confirm connection to %s",
+                               self.address)
+                return False
+
+            # the time passed since the last change counts towards settle
+            elapsed = time.time() - max(self.changed, self.subscribed)
+            time.sleep(max(self.settle - elapsed, 0))
+
+        else:
+            time.sleep(self.settle)
+
+        self.ready = True
+        return True
+
+    def events(self, timeout=0):
+        """ Read the events of the monitor socket, waiting up to timeout
+            seconds for the first one, to be called with the lock held.
+            libzmq reconnects and sends the subscriptions again by itself:
+            after a disconnection the subscription is just not ready until
+            they had time to reach the publisher.
+        """
+        from zmq.utils.monitor import recv_monitor_message
+        while self.monitor.poll(int(timeout * 1000)):
+            event = recv_monitor_message(self.monitor)['event']
+            timeout = 0
+            if event == zmq.EVENT_CONNECTED:
+                self.log.debug("Connected to %s", self.address)
+                self.connected = True
+
+            elif event == zmq.EVENT_DISCONNECTED:
+                self.log.debug("Disconnected from %s", self.address)
+                self.connected = False
+                self.ready = False
+
+            else:
+                continue
+
+            self.changed = time.time()
+
+    def check(self):
+        """ Process the connection events received so far, without waiting
+            for the lock. The prefix of this process is subscribed to in
+            advance, and the subscription marked ready once it has been
+            connected with the same topics for settle seconds, sparing the
+            wait to the next task. Returns whether the socket is connected,
+            or None if it cannot be told now.
+        """
+        if not self.lock.acquire(False):
+            return None
+
+        try:
+            if not self.monitor:
+                return None
+
+            if self.prefix not in self.topics and not self.reading:
+                self.subscribe(self.prefix)
+            self.events()
+            if self.connected and not self.ready and time.time() - \
+               max(self.changed, self.subscribed) >= self.settle:
+                self.ready = True
+            return self.connected
+
+        finally:
+            self.lock.release()
+
+    def reconnect(self):
+        """ Replace the socket with a new one subscribed to the same topics,
+            keeping the followed tasks and their queued messages. Returns
+            False if the socket is in use by another thread.
+        """
+        if not self.lock.acquire(False):
+            return False
+
+        try:
+            if self.reading:
+                return False
+
+            self.log.debug("Reconnecting to %s", self.address)
+            self.close()
+            self.open()
+            for topic in self.topics:
+                self.socket.setsockopt(zmq.SUBSCRIBE, topic)
+            self.subscribed = time.time()
+            return True
+
+        finally:
+            self.lock.release()
+
+    def split_topic(self, topic):
+        """ Split a subscription topic in (task uuid, level) """
+        try:
+            uuid, level = topic.rsplit(".", 1)
+
+        except ValueError:
+            return topic, None
+
+        return uuid, level
+
+    def recv(self, timeout, uuid=None):
+        """ Wait up to timeout seconds for a message of a followed task,
+            or of task uuid only if given.
+            Returns (task uuid, level, message) or None.
+        """
+        deadline = time.time() + timeout
+        with self.lock:
+            while True:
+                message = self.pop(uuid)
+                if message:
+                    return message
+
+                remaining = max(deadline - time.time(), 0)
+                if self.reading:
+                    if not remaining:
+                        return None
+                    self.lock.wait(remaining)
+                    continue
+
+                # the socket is released every poll_interval, for other
+                # threads to (un)subscribe
+                self.reading = True
+                self.lock.release()
+                try:
+                    message = self.read(min(remaining, self.poll_interval))
+
+                finally:
+                    self.lock.acquire()
+                    self.reading = False
+                    self.lock.notify_all()
+
+                if message and message[0] in self.mailboxes:
+                    if uuid is None or message[0] == uuid:
+                        return message
+                    self.mailboxes[message[0]].append(message)
+
+                elif not message and not remaining:
+                    return None
+
+    def pop(self, uuid):
+        """ The first queued message for uuid, or for any task """
+        uuids = [uuid] if uuid else self.mailboxes.keys()
+        for uuid in uuids:
+            if self.mailboxes.get(uuid):
+                return self.mailboxes[uuid].popleft()
+
+    def read(self, timeout):
+        """ Read the socket for a message of a followed task, to be
+            called with reading set.
+        """
+        deadline = time.time() + timeout
+        while True:
+            remaining = max(deadline - time.time(), 0)
+            if not self.poller.poll(int(remaining * 1000)):
+                return None
+
+            topic, msg = self.socket.recv_multipart()
+            uuid, level = self.split_topic(topic)
+            if uuid in self.active:
+                return uuid, level, msg.strip()
+
+            if not remaining:
+                return None
+
+    def close(self):
+        if self.monitor:
+            self.socket.disable_monitor()
+            self.monitor.close(linger=0)
+            self.monitor = None
+        self.socket.close(linger=0)
@@ -16,36 +16,87 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import fnmatch
+import json
+import os
 import plac
+import Queue
+import threading
+import time
 from . interface import BaseInterface
+from . subscription import split_uuid
 from collections import OrderedDict
 
 
 class TaskInterface(BaseInterface):
 
-    commands = ['list', 'logs', 'delete', 'flush', 'info', 'flush_logs']
     name = 'tasks'
+    key_name = 'uuid'
+
+    def cache(self):
+        from . completion import cache_dir
+        from . taskcache import TaskCache
+        return TaskCache(os.path.join(cache_dir(), "{}-tasks.sqlite"\
+                                      .format(self.main.current_remote)))
+
+    def sync(self, cache, quiet=True):
+        """ Bring cache up to date: fetch the tasks requested since the most
+            recent cached one, then the cached tasks that were still
+            running. Tasks unknown to the server are dropped, unless they
+            finished.
+        """
+        newest = cache.newest()
+        query = dict(since=newest) if newest else {}
+        response, content = self.api.get(self.root_url, quiet=quiet,
+                                         query_params=query)
+        content = content or {}
+        for uuid in cache.unfinished():
+            if uuid in content:
+                continue
+            response, data = self.api.get(self.get_url(uuid), quiet=True,
+                                          debug=False, expect=(404, ))
+            if data:
+                content[uuid] = data
+            elif response is not None and response.status_code == 404:
+                cache.delete([uuid])
+        cache.update(content, self.api.pending_statuses)
 
     @plac.annotations(
         full=('Get complete output', 'flag', 'f'),
-        verbose=('Be verbose', 'flag', 'v')
+        verbose=('Be verbose', 'flag', 'v'),
+        since=('Only tasks requested since DATE, i.e. 2012-05-30',
+               'option', 'S', str, None, 'DATE'),
+        status=('Only tasks with STATUS', 'option', 's', str, None,
+                'STATUS'),
+        command=('Only tasks running COMMAND (a glob)', 'option', 'c', str,
+                 None, 'COMMAND'),
+        sort_by=('Sort by requested, status or command', 'option', 'o',
+                 str, ('requested', 'status', 'command'), 'FIELD'),
+        refresh=('Fetch all the tasks again', 'flag', 'r')
     )
-    def list(self, full=False, verbose=False):
-        quiet = not verbose
-        response, content = self.api.get(self.root_url, quiet=quiet)
-        content = content or {}
-        ordered = OrderedDict(sorted(content.items(),
-                                    key=lambda x: x[1]['requested']))
-        if not full:
-            for uid, data in ordered.iteritems():
-                self.log.info(" • {} <{}> [{} - {}]".format(uid,
-                                                    data['command'],
-                                                    data['requested'],
-                                                    data['status']))
-        else:
-            for uid, data in ordered.iteritems():
-                self.log.info(" • {}:" .format(uid))
-                self.print_info(data, prompt='   ° ')
+    def list(self, full=False, verbose=False, since=None, status=None,
+             command=None, sort_by='requested', refresh=False):
+        """ List tasks. Tasks are kept in a local cache, and only the ones
+            that are new or were running are fetched from the server.
+        """
+        cache = self.cache()
+        try:
+            if refresh:
+                cache.clear()
+            self.sync(cache, quiet=not verbose)
+            with self.output.collection(self.key_name) as out:
+                for uid, data in cache.query(since, status, command,
+                                             sort_by):
+                    if full:
+                        out.record(uid, data)
+                        continue
+
+                    out.record(uid, data, line=" • {} <{}> [{} - {}]"\
+                               .format(uid, data['command'],
+                                       data['requested'], data['status']))
+
+        finally:
+            cache.close()
 
     def logs(self, task):
         """ Show tasks logs """
@@ -55,8 +106,251 @@ class TaskInterface(BaseInterface):
             for log in content:
                 self.log.info(log.strip())
 
+    @plac.annotations(
+        resource=('The task to delete', 'positional')
+    )
+    def delete(self, resource):
+        """ Delete a task """
+        response, content = self.api.delete(self.get_url(resource),
+                                            quiet=False)
+        if response is not None and response.ok:
+            cache = self.cache()
+            try:
+                cache.delete([resource])
+
+            finally:
+                cache.close()
+
     def flush(self):
-        self.api.delete(self.root_url, quiet=False)
+        """ Delete all the tasks. The local cache of tasks_list is
+            emptied, the ones still on the server are fetched again.
+        """
+        response, content = self.api.delete(self.root_url, quiet=False)
+        if response is not None and response.ok:
+            cache = self.cache()
+            try:
+                cache.clear()
+
+            finally:
+                cache.close()
 
     def flush_logs(self, task):
         self.api.delete(self.get_url(task, 'logs'), quiet=False)
+
+    def task_command(self, uuid, commands):
+        """ The command of task uuid, cached in commands """
+        if uuid not in commands:
+            response, content = self.api.get(self.get_url(uuid), quiet=True,
+                                             debug=False)
+            commands[uuid] = (content or {}).get('command')
+        return commands[uuid]
+
+    def resolve_commands(self, uuids, commands):
+        """ Fetch the command of the tasks put in the queue uuids into
+            commands, until None is put
+        """
+        while True:
+            uuid = uuids.get()
+            if uuid is None:
+                return
+            self.task_command(uuid, commands)
+
+    def render(self, messages, dropped, dropped_tasks):
+        """ Write the messages received since the last render, with the
+            number of times each was repeated """
+        out = self.output
+        for (uuid, level, msg), count in messages.iteritems():
+            msg = msg.decode('utf-8', 'replace').strip()
+            if out.format != 'table':
+                out.writeline(json.dumps(dict(uuid=uuid, level=level,
+                                              message=msg, count=count)))
+            elif count > 1:
+                out.writeline(u"{}.{}: {} (x{})".format(uuid, level, msg,
+                                                       count))
+            else:
+                out.writeline(u"{}.{}: {}".format(uuid, level, msg))
+
+        if dropped and out.format == 'table':
+            out.writeline(u"... {} more messages from {} tasks"\
+                          .format(dropped, len(dropped_tasks)))
+        out.flush()
+
+    @plac.annotations(
+        user=('Only tasks submitted by USER', 'option', 'u', str, None,
+              'USER'),
+        host=('Only tasks submitted from HOST (a glob)', 'option', 'H', str,
+              None, 'HOST'),
+        command=('Only tasks running COMMAND (a glob)', 'option', 'c', str,
+                 None, 'COMMAND'),
+        level=('Only messages of LEVELS (comma separated)', 'option', 'l',
+               str, None, 'LEVELS'),
+        rate=('Refresh the display RATE times per second', 'option', 'r',
+              float, None, 'RATE'),
+        max_lines=('Show at most LINES messages per refresh', 'option', 'n',
+                   int, None, 'LINES'),
+        duration=('Stop after SECONDS', 'option', 'd', float, None,
+                  'SECONDS')
+    )
+    def follow(self, user=None, host=None, command=None, level=None,
+               rate=4.0, max_lines=40, duration=None):
+        """ Show the messages of every task as they are published, until
+            interrupted. Identical messages received between two refreshes
+            are shown once with their count, and at most max_lines of them
+            are shown per refresh.
+        """
+        import zmq
+        if rate <= 0:
+            self.log.error("The refresh rate must be positive")
+            return
+
+        levels = set(l.strip().lower() for l in level.split(",")) \
+                 if level else None
+        # user filtering is done by the publisher, the other filters look
+        # at the topic only, the message is left undecoded until rendered
+        prefix = "{}..".format(user.replace("@", ".")) if user else ""
+        socket = self.api.zmq_context.socket(zmq.SUB)
+        socket.setsockopt(zmq.SUBSCRIBE, prefix)
+        socket.connect(self.api.sub_addr)
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+        commands = {}
+        messages = OrderedDict()
+        # the uuid of every message over max_lines
+        dropped = []
+        # messages of tasks whose command is being fetched, by uuid
+        unresolved = {}
+        interval = 1.0 / rate
+        deadline = time.time() + duration if duration else None
+        next_render = time.time() + interval
+
+        def add(key):
+            if key in messages:
+                messages[key] = messages[key] + 1
+            elif len(messages) < max_lines:
+                messages[key] = 1
+            else:
+                dropped.append(key[0])
+
+        def release(uuid):
+            # messages buffered while the command of the task was fetched
+            keys = unresolved.pop(uuid)
+            if fnmatch.fnmatch(commands[uuid] or '', command):
+                for key in keys:
+                    add(key)
+
+        def render():
+            # tasks resolved since their last message are not released
+            # by the receive loop
+            for uuid in [u for u in unresolved if u in commands]:
+                release(uuid)
+            self.render(messages, len(dropped), set(dropped))
+            messages.clear()
+            del dropped[:]
+
+        if command:
+            # commands are fetched over HTTP in another thread, so that
+            # receiving and rendering never wait for them
+            resolving = Queue.Queue()
+            resolver = threading.Thread(target=self.resolve_commands,
+                                        args=(resolving, commands),
+                                        name='follow-commands')
+            resolver.daemon = True
+            resolver.start()
+
+        try:
+            while not deadline or time.time() < deadline:
+                wait = max(next_render - time.time(), 0)
+                if poller.poll(int(wait * 1000)):
+                    # drain a bounded number of messages, so that a burst
+                    # does not delay rendering
+                    for i in xrange(1000):
+                        try:
+                            frames = socket.recv_multipart(zmq.NOBLOCK,
+                                                           copy=False)
+
+                        except zmq.Again:
+                            break
+
+                        uuid, sep, lvl = frames[0].bytes.rpartition(".")
+                        if levels and lvl.lower() not in levels:
+                            continue
+                        if host and not fnmatch.fnmatch(
+                                    split_uuid(uuid)[1] or '', host):
+                            continue
+
+                        key = (uuid, lvl, frames[-1].bytes)
+                        if command and uuid not in commands:
+                            if uuid not in unresolved:
+                                unresolved[uuid] = []
+                                resolving.put(uuid)
+                            if len(unresolved[uuid]) < max_lines:
+                                unresolved[uuid].append(key)
+                            continue
+
+                        if command and uuid in unresolved:
+                            # older messages of the task go first
+                            release(uuid)
+
+                        if command and not fnmatch.fnmatch(
+                                commands[uuid] or '', command):
+                            continue
+
+                        add(key)
+
+                if time.time() >= next_render:
+                    render()
+                    next_render = time.time() + interval
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            if command:
+                resolving.put(None)
+            render()
+            socket.close(linger=0)
+
+    @plac.annotations(
+        all_pending=('Wait for all the tasks submitted to this remote that '
+                     'are not known to be over', 'flag', 'a'),
+        timeout=('Give up on the tasks still running after SECONDS',
+                 'option', 't', float, None, 'SECONDS'),
+        uuids=('Tasks to wait for', 'positional')
+    )
+    def wait(self, all_pending=False, timeout=None, *uuids):
+        """ Wait for many tasks at once, showing each one as it completes.
+            Every task submitted by the cli is recorded in a local job
+            table, so that deferred tasks, or the ones that were not waited
+            for, can be waited for later, even from another session.
+        """
+        jobs = OrderedDict()
+        if all_pending:
+            for job in self.main.jobs.pending(self.main.current_remote):
+                jobs[job.uuid] = job
+        for uuid in uuids:
+            jobs[uuid] = self.main.jobs.get(uuid)
+
+        if not jobs:
+            self.log.info("No tasks to wait for")
+            return
+
+        self.log.info("Waiting for %d tasks", len(jobs))
+        with self.output.collection(self.key_name) as out:
+            def on_done(uuid, status):
+                job = jobs[uuid]
+                data = dict(status=status)
+                if job:
+                    data.update(command=job.command, target=job.target,
+                                submitted=time.strftime(
+                                    '%Y-%m-%d %H:%M:%S',
+                                    time.localtime(job.submitted)))
+                out.record(uuid, data, line=u" • {} <{} {}> {}".format(
+                                uuid, data.get('command'),
+                                data.get('target'), status))
+                self.output.flush()
+
+            results = self.api.wait_tasks(list(jobs), timeout, on_done)
+
+        failed = [uuid for uuid in results if results[uuid] != 'FINISHED']
+        self.log.info("%d finished, %d failed", len(results) - len(failed),
+                      len(failed))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import os
+import sqlite3
+
+
+class TaskCache(object):
+    """ The local copy of the task table of a remote, in a sqlite database.
+        Finished tasks never change, so they are kept forever and only new
+        or still running tasks need to be fetched from the server.
+    """
+    orders = ('requested', 'status', 'command')
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS tasks ("
+                        "uuid TEXT PRIMARY KEY, command TEXT, status TEXT, "
+                        "requested TEXT, finished INTEGER, data TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS tasks_requested "
+                        "ON tasks (requested)")
+
+    def close(self):
+        self.db.close()
+
+    def newest(self):
+        """ The requested time of the most recent task, or None """
+        return self.db.execute("SELECT MAX(requested) FROM tasks")\
+                      .fetchone()[0]
+
+    def unfinished(self):
+        return [row[0] for row in self.db.execute(
+                        "SELECT uuid FROM tasks WHERE NOT finished")]
+
+    def update(self, tasks, pending_statuses):
+        """ Store tasks, a dict uuid: task data as returned by /tasks """
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?)",
+                [(uuid, data.get('command'), data.get('status'),
+                  data.get('requested'),
+                  data.get('status') not in pending_statuses,
+                  json.dumps(data))
+                 for uuid, data in tasks.iteritems()])
+
+    def delete(self, uuids):
+        with self.db:
+            self.db.executemany("DELETE FROM tasks WHERE uuid = ?",
+                                [(uuid, ) for uuid in uuids])
+
+    def clear(self):
+        with self.db:
+            self.db.execute("DELETE FROM tasks")
+
+    def query(self, since=None, status=None, command=None,
+              order='requested'):
+        """ Yield (uuid, task data) of the tasks requested since since,
+            with status and command matching the glob command, sorted by
+            order then requested.
+        """
+        if order not in self.orders:
+            raise ValueError("Cannot sort tasks by {}".format(order))
+
+        where = []
+        params = []
+        if since:
+            where.append("requested >= ?")
+            params.append(since)
+        if status:
+            where.append("status = ?")
+            params.append(status.upper())
+        if command:
+            where.append("command GLOB ?")
+            params.append(command)
+
+        sql = "SELECT uuid, data FROM tasks"
+        if where:
+            sql = "{} WHERE {}".format(sql, " AND ".join(where))
+        sql = "{} ORDER BY {}, requested".format(sql, order)
+        for uuid, data in self.db.execute(sql, params):
+            yield uuid, json.loads(data)
@@ -23,7 +23,6 @@ from . interface import BaseInterface
 
 class ThemeInterface(BaseInterface):
 
-    commands = ['list', 'create', 'update', 'info', 'delete']
     name = 'themes'
     size_re = re.compile(r'([\d]+)[x]([\d]+)', re.IGNORECASE)
 
@@ -83,6 +82,4 @@ class ThemeInterface(BaseInterface):
             raise ValueError('Missing options')
 
         response, content = self.api.put(self.get_url(theme), data=attributes)
-        if content:
-            for k, v in content.iteritems():
-                print "{:<20}: {}".format(k, v)
+        self.print_info(content)
@@ -27,9 +27,8 @@ def comma_sep_to_list(string):
 
 class UserInterface(BaseInterface):
 
-    commands = ['list', 'create', 'update', 'info', 'delete', 'check_login',
-                'allowed_instances']
     name = 'users'
+    key_name = 'email'
 
     @plac.annotations(
         email=('User email. It will be used as username', 'positional'),
@@ -124,10 +123,7 @@ class UserInterface(BaseInterface):
             data['groups'] = comma_sep_to_list(data['groups'])
 
         response, content = self.api.put(self.get_url(email), data=data)
-
-        if content:
-            for k, v in content.iteritems():
-                self.log.info(unicode("{:<20}: {}").format(k, v))
+        self.print_info(content)
 
     @plac.annotations(
         domain=('Site domain', 'positional'),
@@ -140,9 +136,7 @@ class UserInterface(BaseInterface):
         res, content = self.api.get("{}?action=login&domain={}"\
                                     .format(self.get_url(email),
                                             domain))
-        if content:
-            for k, v in content.iteritems():
-                self.log.info(unicode("{:<20}: {}").format(k, v))
+        self.print_info(content)
 
     @plac.annotations(
         email=('User email', 'positional')
@@ -151,5 +145,6 @@ class UserInterface(BaseInterface):
         url = self.get_url(email, 'instances')
         response, content = self.api.get(url)
         content = content or {}
-        for res in sorted(content):
-            self.log.info(" • {}".format(res))
+        with self.output.collection('domain') as out:
+            for res in sorted(content):
+                out.record(res, content[res], full=False)
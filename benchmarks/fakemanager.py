@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import base64
+import BaseHTTPServer
+import hashlib
+import heapq
+import json
+import logging
+import os
+import SocketServer
+import threading
+import time
+import urlparse
+import zmq
+
+log = logging.getLogger(__name__)
+
+# what the manager logs while running a task, replayed for every task
+task_log = (
+    ('INFO', "Received task {command} for {target}"),
+    ('DEBUG', "Acquiring lock on {target}"),
+    ('INFO', "Running {command} on {target}"),
+    ('DEBUG', "Writing configuration for {target}"),
+    ('DEBUG', "Sending signal to the application server"),
+    ('INFO', "Task {command} completed"),
+)
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Implements the routes of the manager REST API used by the cli """
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def manager(self):
+        return self.server.manager
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+    def reply(self, body, status=200, headers=None):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).iteritems():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def parse(self):
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        return [p for p in url.path.split("/") if p], query
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        parts, query = self.parse()
+        if not parts:
+            return self.reply({})
+
+        collection = parts[0]
+        if collection == 'instances' and len(parts) == 1:
+            return self.list_instances(query)
+
+        if collection == 'instances':
+            data = self.manager.instances.get(parts[1])
+            if data is None:
+                return self.reply({}, 404)
+            return self.reply(data)
+
+        if collection == 'tasks' and len(parts) == 1:
+            since = query.get('since', '')
+            with self.manager.lock:
+                return self.reply(dict((uuid, task) for uuid, task
+                                       in self.manager.tasks.iteritems()
+                                       if task['requested'] >= since))
+
+        if collection == 'tasks':
+            with self.manager.lock:
+                task = self.manager.tasks.get(parts[1])
+            if task is None:
+                return self.reply({}, 404)
+            if len(parts) > 2 and parts[2] == 'logs':
+                return self.reply(self.manager.task_lines(parts[1], task))
+            return self.reply(task)
+
+        if collection == 'archives' and len(parts) == 1:
+            return self.reply(dict((name, dict(sha256=digest.encode('hex'),
+                                               size=size))
+                                   for name, (size, digest)
+                                   in self.manager.archives.iteritems()))
+
+        if collection == 'archives':
+            return self.send_archive(parts[1])
+
+        return self.reply({})
+
+    def list_instances(self, query):
+        manager = self.manager
+        if self.headers.get('if-none-match') == manager.etag:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        domains = manager.domains
+        if 'limit' in query:
+            offset = int(query.get('offset', 0))
+            domains = domains[offset:offset + int(query['limit'])]
+        fields = query.get('fields')
+        fields = fields.split(",") if fields else None
+        self.reply(dict((d, manager.instance(d, fields)) for d in domains),
+                   headers={'ETag': manager.etag})
+
+    def send_archive(self, name):
+        if name.endswith(".tar.gz"):
+            name = name[:-len(".tar.gz")]
+        if name not in self.manager.archives:
+            return self.reply({}, 404)
+
+        size, digest = self.manager.archives[name]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-gzip')
+        self.send_header('Content-Length', str(size))
+        self.send_header('Digest',
+                         'SHA-256={}'.format(base64.b64encode(digest)))
+        self.end_headers()
+        for chunk in self.manager.archive_chunks(size):
+            self.wfile.write(chunk)
+
+    def submit(self):
+        length = int(self.headers.get('content-length', 0))
+        # the upload of an archive is discarded as it is read
+        while length > 0:
+            length = length - len(self.rfile.read(min(length, 65536)))
+
+        parts, query = self.parse()
+        uuid = self.headers.get('x-task-uuid')
+        if not uuid:
+            return self.reply({})
+
+        command = "{}.{}".format(parts[0].rstrip("s") if parts else 'manager',
+                                 self.command.lower())
+        target = parts[1] if len(parts) > 1 else '*'
+        self.manager.run_task(uuid, command, target)
+        self.reply({}, headers={'X-Task-UUID': uuid,
+                                'X-Task-Status': 'QUEUED'})
+
+    do_PUT = do_POST = do_DELETE = submit
+
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeManager(object):
+    """ A stand-in for the aybu manager, listening on localhost: the REST
+        API on an HTTP server and the task logs on a ZMQ PUB socket.
+        Every task replays task_log, one line each task_delay /
+        len(task_log) seconds, then publishes its finished message.
+    """
+
+    def __init__(self, instances=100, task_delay=0.05, archive_size=0,
+                 http_port=0, pub_port=0):
+        self.domains = sorted("site{:05d}.example.com".format(i)
+                              for i in xrange(instances))
+        self.instances = dict((d, dict(environment_name="env{}".format(i % 4),
+                                       enabled=True,
+                                       owner_email="owner@example.com",
+                                       technical_contact_email=
+                                            "tech@example.com",
+                                       default_language='it',
+                                       theme_name='uffizi'))
+                              for i, d in enumerate(self.domains))
+        self.etag = '"{}"'.format(instances)
+        self.task_delay = task_delay
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self.block = os.urandom(1024 * 1024)
+        self.archives = {}
+        if archive_size:
+            self.add_archive('backup', archive_size)
+
+        self.http = HTTPServer(('127.0.0.1', http_port), Handler)
+        self.http.manager = self
+        self.context = zmq.Context()
+        self.pub = self.context.socket(zmq.PUB)
+        self.pub.setsockopt(zmq.SNDHWM, 0)
+        if pub_port:
+            self.pub.bind("tcp://127.0.0.1:{}".format(pub_port))
+            self.pub_port = pub_port
+        else:
+            self.pub_port = self.pub.bind_to_random_port("tcp://127.0.0.1")
+
+        # messages waiting to be published, as a heap of (when, frames)
+        self.schedule = []
+        self.scheduled = threading.Condition()
+        self.running = False
+        self.threads = []
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.http.server_address[1])
+
+    @property
+    def pub_addr(self):
+        return "tcp://127.0.0.1:{}".format(self.pub_port)
+
+    def instance(self, domain, fields=None):
+        data = self.instances[domain]
+        if fields:
+            data = dict((k, v) for k, v in data.iteritems() if k in fields)
+        return data
+
+    def add_archive(self, name, size):
+        digest = hashlib.sha256()
+        for chunk in self.archive_chunks(size):
+            digest.update(chunk)
+        self.archives[name] = (size, digest.digest())
+
+    def archive_chunks(self, size):
+        while size > 0:
+            chunk = self.block[:size]
+            size = size - len(chunk)
+            yield chunk
+
+    def task_lines(self, uuid, task):
+        return ["{}: {}".format(level, msg.format(**task))
+                for level, msg in task_log]
+
+    def run_task(self, uuid, command, target):
+        now = time.time()
+        task = dict(command=command, target=target, status='QUEUED',
+                    requested=time.strftime('%Y-%m-%d %H:%M:%S',
+                                            time.localtime(now)) +
+                              '.{:06d}'.format(int(now % 1 * 1000000)))
+        with self.lock:
+            self.tasks[uuid] = task
+
+        step = self.task_delay / len(task_log)
+        with self.scheduled:
+            for i, (level, msg) in enumerate(task_log):
+                heapq.heappush(self.schedule,
+                               (now + step * i,
+                                ["{}.{}".format(uuid, level),
+                                 msg.format(**task)]))
+            heapq.heappush(self.schedule,
+                           (now + self.task_delay,
+                            ["{}.finished".format(uuid), "FINISHED"]))
+            self.scheduled.notify()
+
+    def publish(self):
+        """ Send the scheduled messages when they are due. The PUB socket
+            is only used by this thread.
+        """
+        while self.running:
+            with self.scheduled:
+                while self.running and not self.schedule:
+                    self.scheduled.wait(0.5)
+                if not self.running:
+                    return
+                when, frames = self.schedule[0]
+                delay = when - time.time()
+                if delay > 0:
+                    self.scheduled.wait(delay)
+                    continue
+                heapq.heappop(self.schedule)
+
+            topic = frames[0]
+            if topic.endswith(".finished"):
+                with self.lock:
+                    self.tasks[topic.rpartition(".")[0]]['status'] = \
+                            'FINISHED'
+            self.pub.send_multipart(frames)
+
+    def start(self):
+        self.running = True
+        for target in (self.http.serve_forever, self.publish):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        self.running = False
+        with self.scheduled:
+            self.scheduled.notify()
+        self.http.shutdown()
+        self.http.server_close()
+        for thread in self.threads:
+            thread.join()
+        self.pub.close(linger=0)
+        self.context.term()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, etype, exc, tb):
+        self.stop()
+
+    def write_config(self, path, remote='default', **options):
+        """ Write a cli config file with a remote section for this manager """
+        options = dict(dict(username='bench@example.com', password='bench',
+                            heartbeat_interval=10, cache_size=0),
+                       **options)
+        with open(path, 'w') as f:
+            f.write("[{}]\n".format(remote))
+            f.write("host = {}\n".format(self.url))
+            f.write("subscription_addr = {}\n".format(self.pub_addr))
+            for option, value in sorted(options.iteritems()):
+                f.write("{} = {}\n".format(option, value))
+        return path
+
+
+if __name__ == '__main__':
+    import plac
+
+    @plac.annotations(
+        instances=('Number of instances', 'option', 'n', int),
+        task_delay=('Seconds every task takes', 'option', 'd', float),
+        archive_size=('Size of the "backup" archive in MB', 'option', 'a',
+                      int),
+        http_port=('HTTP port', 'option', 'p', int),
+        pub_port=('ZMQ PUB port', 'option', 's', int),
+        config=('Write a cli config file for the manager to FILE', 'option',
+                'c', str, None, 'FILE')
+    )
+    def serve(instances=100, task_delay=0.05, archive_size=0, http_port=8765,
+              pub_port=8999, config=None):
+        """ Run a fake manager until interrupted """
+        logging.basicConfig(level=logging.INFO)
+        manager = FakeManager(instances, task_delay,
+                              archive_size * 1024 * 1024, http_port, pub_port)
+        if config:
+            manager.write_config(config)
+        with manager:
+            log.info("Fake manager on %s, publishing on %s", manager.url,
+                     manager.pub_addr)
+            try:
+                while True:
+                    time.sleep(1)
+
+            except KeyboardInterrupt:
+                pass
+
+    plac.call(serve)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright 2010-2012 Asidev s.r.l.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import plac
+
+# run the cli from this checkout rather than from an installed copy
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from aybu.manager.cli import codec
+from aybu.manager.cli.main import AybuManagerCliInterface
+from aybu.manager.cli.metrics import percentile
+from aybu.manager.cli.output import Output
+from fakemanager import FakeManager
+
+log = logging.getLogger('benchmarks')
+
+
+def median(values):
+    return percentile(sorted(values), 50)
+
+
+class Runner(object):
+    """ Run cli commands in process against a FakeManager, as the shell
+        would, timing them. Command output is discarded and the cli only
+        logs warnings.
+    """
+
+    def __init__(self, manager, directory, repeat=5):
+        self.manager = manager
+        self.directory = directory
+        self.repeat = repeat
+        # keep the job table and the completion index of the runs out of
+        # the user's cache
+        os.environ['XDG_CACHE_HOME'] = directory
+        # enough pooled connections for the concurrency of bulk
+        self.config = manager.write_config(os.path.join(directory, 'cli.ini'),
+                                           pool_maxsize=50)
+        self.cli = AybuManagerCliInterface(self.config, False, 'default',
+                                           None, 'jsonl', None, None, False,
+                                           None, False, None, False)
+        self.cli._interact_ = False
+        self.cli.set_log_level(logging.WARNING)
+        self.devnull = open(os.devnull, 'w')
+        self.cli.output = Output('jsonl', stream=self.devnull)
+        self.parser = plac.parser_from(self.cli)
+
+    def close(self):
+        self.cli.__exit__(None, None, None)
+        self.devnull.close()
+
+    def run(self, *args):
+        """ Run a command, returning the seconds it took """
+        start = time.time()
+        cmd, result = self.parser.consume(list(args))
+        if hasattr(result, 'next'):
+            for value in result:
+                pass
+        return time.time() - start
+
+    def timings(self, *args):
+        """ Run a command once to warm up, then repeat times """
+        self.run(*args)
+        return [self.run(*args) for i in xrange(self.repeat)]
+
+    def list(self):
+        """ instances_list over every instance, in one request and in pages
+            of 1000
+        """
+        count = len(self.manager.domains)
+        res = OrderedDict()
+        for name, args in (('single', ('instances_list', '-f')),
+                           ('paged', ('instances_list', '-f', '-p', '1000')),
+                           ('short', ('instances_list', ))):
+            seconds = median(self.timings(*args))
+            res[name] = OrderedDict((('seconds', seconds),
+                                     ('resources_per_second',
+                                      count / seconds)))
+        res['resources'] = count
+        return res
+
+    def bulk(self, tasks=1000, concurrency=50):
+        """ instances_bulk reload on tasks instances """
+        domains = self.manager.domains[:tasks]
+        args = ['instances_bulk', 'reload', '-c', str(concurrency)] + domains
+        seconds = median(self.timings(*args))
+        # the fastest possible run, if the client added no overhead
+        ideal = float(tasks) / concurrency * self.manager.task_delay
+        return OrderedDict((('tasks', tasks), ('concurrency', concurrency),
+                            ('seconds', seconds),
+                            ('tasks_per_second', tasks / seconds),
+                            ('efficiency', ideal / seconds)))
+
+    def latency(self, tasks=50):
+        """ instances_reload, one task at a time: time from submission to
+            completion, less the time the fake manager takes to run it
+        """
+        domain = self.manager.domains[0]
+        self.run('instances_reload', domain)
+        samples = sorted(self.run('instances_reload', domain)
+                         for i in xrange(tasks))
+        overhead = [s - self.manager.task_delay for s in samples]
+        return OrderedDict((('tasks', tasks),
+                            ('task_seconds', self.manager.task_delay),
+                            ('p50', percentile(samples, 50)),
+                            ('p95', percentile(samples, 95)),
+                            ('p99', percentile(samples, 99)),
+                            ('overhead_p50', percentile(overhead, 50)),
+                            ('overhead_p95', percentile(overhead, 95))))
+
+    def archive(self):
+        """ archives_download of the backup archive """
+        size, digest = self.manager.archives['backup']
+        destination = os.path.join(self.directory, 'backup')
+
+        def download():
+            seconds = self.run('archives_download', '-r', 'backup',
+                               destination)
+            os.unlink("{}.tar.gz".format(destination))
+            return seconds
+
+        download()
+        seconds = median([download() for i in xrange(self.repeat)])
+        return OrderedDict((('bytes', size), ('seconds', seconds),
+                            ('mb_per_second', size / seconds / 1024 / 1024)))
+
+    def startup(self):
+        """ Wall time of running the cli in a new process: help_commands
+            loads no interface, instances_info makes a request
+        """
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+                                filter(None, [root, env.get('PYTHONPATH')]))
+        cmd = [sys.executable, '-c',
+               'from aybu.manager.cli.main import main; main()',
+               '-F', self.config]
+        res = OrderedDict()
+        for name, args in (('help', ['help_commands']),
+                           ('request', ['instances_info',
+                                        self.manager.domains[0]])):
+            samples = []
+            for i in xrange(self.repeat + 1):
+                start = time.time()
+                subprocess.check_call(cmd + args, env=env,
+                                      stdout=self.devnull,
+                                      stderr=self.devnull)
+                samples.append(time.time() - start)
+            res[name] = median(samples[1:])
+        return res
+
+    def decode(self, sizes=(1000, 10000, 100000)):
+        """ Decoding of /instances bodies of sizes records with every
+            installed json codec
+        """
+        data = self.manager.instance(self.manager.domains[0])
+        res = OrderedDict()
+        for size in sizes:
+            body = json.dumps(dict(("site{:06d}.example.com".format(i), data)
+                                   for i in xrange(size)))
+            res[size] = OrderedDict((('bytes', len(body)), ))
+            for name in codec.available():
+                loads = codec.get(name).loads
+                samples = []
+                for i in xrange(self.repeat):
+                    start = time.time()
+                    loads(body)
+                    samples.append(time.time() - start)
+                res[size][name] = median(samples)
+        return res
+
+
+benchmarks = ('list', 'bulk', 'latency', 'archive', 'startup', 'decode')
+
+
+def compare(results, baseline):
+    """ Log the relative change of every number in results from baseline """
+    def flatten(data, prefix=''):
+        for key, value in data.iteritems():
+            if isinstance(value, dict):
+                for item in flatten(value, "{}{}.".format(prefix, key)):
+                    yield item
+            elif isinstance(value, (int, float)):
+                yield "{}{}".format(prefix, key), value
+
+    old = dict(flatten(baseline.get('results', {})))
+    for key, value in flatten(results):
+        if old.get(key):
+            log.info("%-40s %12.4f %12.4f %+7.1f%%", key, old[key], value,
+                     (value - old[key]) * 100.0 / old[key])
+
+
+@plac.annotations(
+    output=('Write the results to FILE', 'option', 'o', str, None, 'FILE'),
+    baseline=('Compare the results with those in FILE', 'option', 'b', str,
+              None, 'FILE'),
+    repeat=('Repeat every measure N times, reporting the median', 'option',
+            'r', int, None, 'N'),
+    instances=('Number of instances of the fake manager', 'option', 'n',
+               int, None, 'N'),
+    tasks=('Number of tasks of the bulk benchmark', 'option', 't', int,
+           None, 'N'),
+    task_delay=('Seconds every task of the fake manager takes', 'option',
+                'd', float, None, 'SECONDS'),
+    archive_size=('Size of the downloaded archive in MB', 'option', 'a', int,
+                  None, 'MB'),
+    names=('Benchmarks to run, all by default', 'positional', None, str,
+           benchmarks)
+)
+def main(output=None, baseline=None, repeat=5, instances=10000, tasks=1000,
+         task_delay=0.05, archive_size=64, *names):
+    """ Benchmark the cli against a local fake manager """
+    log.addHandler(logging.StreamHandler())
+    log.setLevel(logging.INFO)
+    names = names or benchmarks
+    directory = tempfile.mkdtemp(prefix='aybu-bench-')
+    results = OrderedDict()
+    try:
+        with FakeManager(instances, task_delay,
+                         archive_size * 1024 * 1024) as manager:
+            runner = Runner(manager, directory, repeat)
+            try:
+                for name in names:
+                    log.info("Running %s", name)
+                    if name == 'bulk':
+                        results[name] = runner.bulk(min(tasks, instances))
+                    else:
+                        results[name] = getattr(runner, name)()
+                    log.info(json.dumps(results[name], indent=2))
+
+            finally:
+                runner.close()
+
+    finally:
+        shutil.rmtree(directory)
+
+    report = OrderedDict((('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                          ('python', platform.python_version()),
+                          ('platform', platform.platform()),
+                          ('parameters', OrderedDict((
+                                ('repeat', repeat),
+                                ('instances', instances),
+                                ('tasks', tasks),
+                                ('task_delay', task_delay),
+                                ('archive_size', archive_size)))),
+                          ('results', results)))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    if baseline:
+        with open(baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    plac.call(main)
@@ -25,6 +25,7 @@ setup(name='aybu-manager-cli',
       entry_points = """\
       [console_scripts]
         aybu_manager_cli = aybu.manager.cli.main:main
+        aybu_manager_complete = aybu.manager.cli.completion:main
       """,
       tests_require=('nose', 'coverage'),
       setup_requires=('versiontools >= 1.8',),